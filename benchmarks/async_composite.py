@@ -0,0 +1,72 @@
+"""
+Sync vs Async Benchmark
+=======================
+
+Latency of a composite request (session lookup in Redis, user record from
+DynamoDB, latest spotting from Elasticsearch) made with the blocking utils
+one call after another, and with the async utils under asyncio.gather
+
+Usage
+    docker-compose up -d
+    python benchmarks/async_composite.py [runs]
+"""
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DYNAMO_URL", "http://localhost:9400")
+os.environ.setdefault("ES_URI", "http://localhost:9200")
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+os.environ.setdefault("AWS_ACCESS_KEY", "local")
+os.environ.setdefault("AWS_SECRET_KEY", "local")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+
+from utils import redis, dynamo, elastic, aioredis, aiodynamo, aioelastic
+from utils.aioclients import close_async_clients
+from utils.session import session_key
+
+SESSION = session_key("bench")
+USER = { "username": "bench", "index": "Basterds" }
+INDEX = "user-spottings"
+LATEST = { "sort": [{ "timestamp": "desc" }], "size": 1, "track_total_hits": False }
+
+def composite_sync():
+    return (
+        redis.get_data(SESSION),
+        dynamo.get_record("users", USER),
+        elastic.list_documents(INDEX, LATEST)
+    )
+
+async def composite_async():
+    return await asyncio.gather(
+        aioredis.get_data(SESSION),
+        aiodynamo.get_record("users", USER),
+        aioelastic.list_documents(INDEX, LATEST)
+    )
+
+async def run_async(runs):
+    await composite_async() # Warm up connections
+    start = time.perf_counter()
+    for i in range(runs):
+        await composite_async()
+    elapsed = time.perf_counter() - start
+    await close_async_clients()
+    return elapsed
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    redis.set_data({ "username": "bench", "expiry_timestamp": int(time.time()) + 3600 }, SESSION, 3600)
+
+    composite_sync() # Warm up connections
+    start = time.perf_counter()
+    for i in range(runs):
+        composite_sync()
+    syncElapsed = time.perf_counter() - start
+    asyncElapsed = asyncio.run(run_async(runs))
+
+    print("{:<24}{:>10.2f}ms/request".format("sync", syncElapsed * 1000 / runs))
+    print("{:<24}{:>10.2f}ms/request".format("async (gather)", asyncElapsed * 1000 / runs))
+    redis.delete_key(SESSION)
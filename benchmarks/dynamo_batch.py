@@ -0,0 +1,72 @@
+"""
+DynamoDB Batch Benchmark
+========================
+
+Compares single-item writes / reads against batch_write_records and
+batch_get_records on DynamoDB Local (see docker-compose.yaml)
+
+Usage
+    docker-compose up -d dynamodb
+    python benchmarks/dynamo_batch.py [count]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DYNAMO_URL", "http://localhost:9400")
+os.environ.setdefault("AWS_ACCESS_KEY", "local")
+os.environ.setdefault("AWS_SECRET_KEY", "local")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+
+from utils.clients import dynamo_client
+from utils.dynamo import create_or_update_record, get_record, batch_get_records, batch_write_records
+
+client = dynamo_client()
+TABLE = "bench-users"
+
+def setup():
+    if TABLE in client.list_tables()['TableNames']:
+        client.delete_table(TableName = TABLE)
+        client.get_waiter("table_not_exists").wait(TableName = TABLE)
+    client.create_table(
+        TableName = TABLE,
+        KeySchema = [
+            { "AttributeName": "username", "KeyType": "HASH" },
+            { "AttributeName": "index", "KeyType": "RANGE" }
+        ],
+        AttributeDefinitions = [
+            { "AttributeName": "username", "AttributeType": "S" },
+            { "AttributeName": "index", "AttributeType": "S" }
+        ],
+        BillingMode = "PAY_PER_REQUEST"
+    )
+    client.get_waiter("table_exists").wait(TableName = TABLE)
+
+def timed(label, fn):
+    start = time.perf_counter()
+    res = fn()
+    print("{:<36}{:>10.3f}s".format(label, time.perf_counter() - start))
+    return res
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    records = [
+        { "username": "user{}".format(i), "index": "Bench", "email": "user{}@example.com".format(i), "created_timestamp": i }
+        for i in range(count)
+    ]
+    keys = [{ "username": r['username'], "index": r['index'] } for r in records]
+
+    setup()
+    timed("create_or_update_record x{}".format(count), lambda: [create_or_update_record(TABLE, r) for r in records])
+    setup()
+    timed("batch_write_records", lambda: batch_write_records(TABLE, records))
+    setup()
+    timed("batch_write_records (4 workers)", lambda: batch_write_records(TABLE, records, workers = 4))
+
+    timed("get_record x{}".format(count), lambda: [get_record(TABLE, k) for k in keys])
+    docs = timed("batch_get_records", lambda: batch_get_records(TABLE, keys))
+    timed("batch_get_records (4 workers)", lambda: batch_get_records(TABLE, keys, workers = 4))
+    assert len(docs) == count
+
+    client.delete_table(TableName = TABLE)
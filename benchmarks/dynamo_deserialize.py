@@ -0,0 +1,54 @@
+"""
+DynamoDB Deserializer Benchmark
+===============================
+
+Per-item CPU cost of the resource pipeline (TypeDeserializer + ensure_json)
+against deserialize_item, on synthetic user-like items in wire format
+
+Usage
+    python benchmarks/dynamo_deserialize.py [count]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from boto3.dynamodb.types import TypeDeserializer
+
+from utils.dynamo import ensure_json, deserialize_item
+
+def make_item(i):
+    return {
+        "username": { "S": "user{}".format(i) },
+        "index": { "S": "Updog" },
+        "email": { "S": "user{}@example.com".format(i) },
+        "password": { "S": "gAAAAAB" + "x" * 93 },
+        "created_timestamp": { "N": str(1620000000 + i) },
+        "rating": { "N": "4.5" },
+        "verified": { "BOOL": True },
+        "bio": { "NULL": True },
+        "favourites": { "L": [{ "S": "WAP-7" }, { "S": "WDM-3A" }, { "N": "12951" }] },
+        "stats": { "M": { "spottings": { "N": str(i % 500) }, "journeys": { "N": str(i % 50) } } }
+    }
+
+def resource_pipeline(items):
+    deserializer = TypeDeserializer()
+    return ensure_json([{ k: deserializer.deserialize(v) for k, v in item.items() } for item in items])
+
+def fast_pipeline(items):
+    return [deserialize_item(item) for item in items]
+
+def timed(label, fn, items):
+    start = time.perf_counter()
+    res = fn(items)
+    elapsed = time.perf_counter() - start
+    print("{:<32}{:>10.3f}s{:>10.2f}us/item".format(label, elapsed, elapsed * 1e6 / len(items)))
+    return res
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    items = [make_item(i) for i in range(count)]
+    slow = timed("TypeDeserializer + ensure_json", resource_pipeline, items)
+    fast = timed("deserialize_item", fast_pipeline, items)
+    assert slow == fast
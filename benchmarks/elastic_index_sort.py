@@ -0,0 +1,75 @@
+"""
+Elasticsearch Index Sort Benchmark
+==================================
+
+Latency of the "most recent spotting" query on a dynamically mapped index
+against an index created from the spotting template (timestamp sorted)
+Runs against the local Elasticsearch from docker-compose.yaml
+
+Usage
+    docker-compose up -d elasticsearch
+    python benchmarks/elastic_index_sort.py [count] [runs]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("ES_URI", "http://localhost:9200")
+
+from utils.clients import elastic_client
+from utils.elastic import bulk_index
+from utils.spotting import TEMPLATE
+
+DYNAMIC = "bench-spottings-dynamic"
+SORTED = "bench-spottings-sorted"
+
+def make_doc(i):
+    return {
+        "username": "user{}".format(random.randint(0, 999)),
+        "spotting_category": random.choice(["loco", "train", "station"]),
+        "loco_class": random.choice(["WAP-7", "WAG-9", "WDM-3A", "WDP-4D"]),
+        "is_active": True,
+        "timestamp": 1577836800 + random.randint(0, 50000000)
+    }
+
+def setup(count):
+    ES = elastic_client()
+    for index in [DYNAMIC, SORTED]:
+        ES.indices.delete(index = index, ignore = [404])
+    # Without the aliases, the bench index must not join the read alias
+    ES.indices.create(index = SORTED, body = { k: v for k, v in TEMPLATE['template'].items() if k != "aliases" })
+    docs = [make_doc(i) for i in range(count)]
+    for index in [DYNAMIC, SORTED]:
+        res = bulk_index(((index, str(i), doc) for i, doc in enumerate(docs)), pauseRefresh = None)
+        if isinstance(res, Exception):
+            raise res
+        ES.indices.refresh(index = index)
+        ES.indices.forcemerge(index = index, max_num_segments = 1)
+
+def most_recent(index, username, earlyTerminate):
+    query = {
+        "sort": [{ "timestamp": "desc" }],
+        "size": 1,
+        "query": { "term": { "username": username } }
+    }
+    if earlyTerminate:
+        query['track_total_hits'] = False
+    return elastic_client().search(body = query, index = index, request_cache = False)
+
+def timed(label, index, runs, earlyTerminate):
+    start = time.perf_counter()
+    for i in range(runs):
+        most_recent(index, "user{}".format(i % 1000), earlyTerminate)
+    elapsed = time.perf_counter() - start
+    print("{:<36}{:>10.2f}ms/query".format(label, elapsed * 1000 / runs))
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    setup(count)
+    timed("dynamic mapping", DYNAMIC, runs, False)
+    timed("template + index sort", SORTED, runs, True)
+    for index in [DYNAMIC, SORTED]:
+        elastic_client().indices.delete(index = index)
@@ -0,0 +1,72 @@
+"""
+Redis Codec Benchmark
+=====================
+
+Encode / decode time and stored size of realistic cache values with the
+stdlib json pipeline used before, against utils.codec
+
+Usage
+    python benchmarks/redis_codec.py [runs]
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils import codec
+
+PAYLOADS = {
+    "session": {
+        "username": "railfan42",
+        "login_timestamp": 1620000000,
+        "expiry_timestamp": 1620007200
+    },
+    "active journey": {
+        "_id": "JRNY0042",
+        "timestamp": 1620000000
+    },
+    "user stats": {
+        "username": "railfan42",
+        "total_spottings": 1834,
+        "categories": { "loco": 1210, "train": 512, "station": 112 },
+        "loco_classes": { "WAP-{}".format(i): i * 7 for i in range(1, 40) },
+        "months": { "20{}-{:02d}".format(18 + i // 12, i % 12 + 1): i * 3 for i in range(40) },
+        "timestamp": 1620000000
+    },
+    # Largest value stored today: every bucket of user_stats filled, 20 years of months
+    "user stats (max)": {
+        "username": "railfan42",
+        "total_spottings": 48211,
+        "categories": { "category-{}".format(i): 1000 + i for i in range(20) },
+        "loco_classes": { "WDG-{}{}".format(i, chr(65 + i % 26)): 100 + i * 7 for i in range(50) },
+        "months": { "{}-{:02d}".format(2001 + i // 12, i % 12 + 1): i * 3 for i in range(240) },
+        "timestamp": 1620000000
+    }
+}
+
+def stdlib_encode(obj):
+    return json.dumps(obj)
+
+def stdlib_decode(raw):
+    return json.loads(raw.encode().decode())
+
+def timed(fn, arg, runs):
+    start = time.perf_counter()
+    for i in range(runs):
+        res = fn(arg)
+    return res, (time.perf_counter() - start) * 1e6 / runs
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print("serializer: {}, compression: zlib\n".format("orjson" if codec.orjson else "json"))
+    print("{:<24}{:<10}{:>12}{:>14}{:>14}".format("payload", "codec", "bytes", "encode us", "decode us"))
+    for name, payload in PAYLOADS.items():
+        n = runs
+        raw, encodeUs = timed(stdlib_encode, payload, n)
+        _, decodeUs = timed(stdlib_decode, raw, n)
+        print("{:<24}{:<10}{:>12}{:>14.1f}{:>14.1f}".format(name, "json", len(raw.encode()), encodeUs, decodeUs))
+        raw, encodeUs = timed(codec.encode, payload, n)
+        _, decodeUs = timed(codec.decode, raw, n)
+        print("{:<24}{:<10}{:>12}{:>14.1f}{:>14.1f}".format("", "codec", len(raw), encodeUs, decodeUs))
@@ -0,0 +1,57 @@
+"""
+Startup Benchmark
+=================
+
+Import-time report for each handler entry point, built from
+`python -X importtime`, to keep an eye on Lambda cold starts
+
+Usage
+    python benchmarks/startup.py [top]
+"""
+import os
+import sys
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+HANDLERS = ["handlers.user", "handlers.spotting"]
+
+def import_times(module):
+    """
+    Function to profile the import of one module in a fresh interpreter
+
+    Params:
+        module::str
+            The dotted module path to import
+    Returns:
+        rows::[(int, int, str)]
+            Self and cumulative import time in microseconds per module
+    """
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        cwd = ROOT,
+        capture_output = True,
+        text = True
+    )
+    if res.returncode != 0:
+        raise Exception(res.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        selfUs, cumulativeUs, name = line[len("import time:"):].split("|")
+        rows.append((int(selfUs), int(cumulativeUs), name.strip()))
+    return rows
+
+if __name__ == "__main__":
+    top = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for module in HANDLERS:
+        try:
+            rows = import_times(module)
+        except Exception as e:
+            print("{}: import failed ({})\n".format(module, e))
+            continue
+        total = next(c for s, c, n in rows if n == module)
+        print("{}: {:.1f}ms total".format(module, total / 1000))
+        for selfUs, cumulativeUs, name in sorted(rows, key = lambda r: r[0], reverse = True)[:top]:
+            print("    {:>10.1f}ms self {:>10.1f}ms cumulative  {}".format(selfUs / 1000, cumulativeUs / 1000, name.strip()))
+        print()
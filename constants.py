@@ -26,6 +26,16 @@ REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD')
 
 DYNAMO_URL = os.environ.get('DYNAMO_URL')
 
+# Connection pool tuning, size pools to the number of worker threads
+DYNAMO_MAX_POOL = int(os.environ.get('DYNAMO_MAX_POOL', 25))
+DYNAMO_MAX_ATTEMPTS = int(os.environ.get('DYNAMO_MAX_ATTEMPTS', 5))
+ES_MAX_POOL = int(os.environ.get('ES_MAX_POOL', 25))
+ES_MAX_RETRIES = int(os.environ.get('ES_MAX_RETRIES', 3))
+REDIS_MAX_POOL = int(os.environ.get('REDIS_MAX_POOL', 25))
+REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 5))
+CONNECT_TIMEOUT = float(os.environ.get('CONNECT_TIMEOUT', 2))
+READ_TIMEOUT = float(os.environ.get('READ_TIMEOUT', 10))
+
 COORDINATES = {
     "loco_number": { "x": 140, "y": 123 },
     "loco_class": { "x": 120, "y": 62 },
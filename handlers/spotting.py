@@ -1,7 +1,9 @@
 import json
 
 from utils.spotting import *
+from utils.session import authorized
 
+@authorized
 def new_spotting_handler(event, context):
     if not event or not isinstance(event, dict):
         return { "status": 400 }
@@ -10,15 +12,11 @@ def new_spotting_handler(event, context):
     body = json.loads(event['body'])
     if not isinstance(body, dict) or len(body) < 1 or not { "username", "spotting_category" }.issubset(body):
         return { "status": 400 }
-    last = most_recent_spotting()
-    if last:
-        lastId = int(last['_id'].replace("SPOT", ""))
-        if lastId < 1000:
-            nextId = str(lastId + 1).zfill(4)[-4]
-        else:
-            nextId = str(lastId + 1)
-    else:
-        nextId = "SPOT0001"
+    if body['username'] != event['session']['username']:
+        return { "status": 403 }
+    nextId = next_spotting_id()
+    if not nextId:
+        return { "status": 500 }
     createRes = create_spotting(nextId, body)
     if createRes is None:
         pass
@@ -1,7 +1,7 @@
 import json
 
 from utils.user import login_user, signup_user, logout_user
-from utils.redis import delete_key
+from utils.session import authorized, end_session
 
 """
 REQUEST STRUCTURE
@@ -56,16 +56,9 @@ def user_login_handler(event, context):
         return { "status": 200, "body": json.dumps(loginRes) }
     return { "status": 404 }
 
+@authorized
 def user_logout_handler(event, context):
-    if not event or not isinstance(event, dict):
-        return { "status": 400 }
-    if "headers" not in event or not event['headers']:
-        return { "status": 400 }
-    headers = event['headers']
-    token = headers['Authorization'].replace("Bearer ", "")
-    if len(token) < 1:
-        return { "status": 400 }
-    logoutRes = delete_key(token)
+    logoutRes = end_session(event['session']['key'])
     if logoutRes is None:
         return { "status": 400 }
     if logoutRes:
@@ -0,0 +1,124 @@
+"""
+Async Client Utils
+==================
+
+Shared asyncio clients for DynamoDB, Elasticsearch and Redis, configured
+like the ones in utils.clients
+They need aiohttp (elasticsearch[async]), redis>=4.2 (redis.asyncio) and
+aiobotocore, pinned in requirements-async.txt, which replaces
+requirements.txt wherever these clients are used
+
+Functions
+    - async_dynamo_client
+    - async_elastic_client
+    - async_redis_client
+    - close_async_clients
+"""
+import asyncio
+from contextlib import AsyncExitStack
+
+from constants import (
+    AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION, DYNAMO_URL, ES_URI,
+    REDIS_HOST, REDIS_PORT, REDIS_PASSWORD,
+    DYNAMO_MAX_POOL, DYNAMO_MAX_ATTEMPTS, ES_MAX_POOL, ES_MAX_RETRIES, REDIS_MAX_POOL, REDIS_POOL_TIMEOUT,
+    CONNECT_TIMEOUT, READ_TIMEOUT
+)
+
+_clients = {}
+_stack = None
+_lock = None
+
+async def async_dynamo_client():
+    """
+    Function to get the shared async low-level DynamoDB client
+
+    Returns:
+        client::aiobotocore.client.DynamoDB
+            The DynamoDB client
+    """
+    global _stack, _lock
+    if "dynamo" not in _clients:
+        if _lock is None:
+            _lock = asyncio.Lock()
+        async with _lock:
+            if "dynamo" not in _clients:
+                from aiobotocore.session import get_session
+                from botocore.config import Config
+
+                if _stack is None:
+                    _stack = AsyncExitStack()
+                _clients['dynamo'] = await _stack.enter_async_context(get_session().create_client(
+                    'dynamodb',
+                    aws_access_key_id = AWS_ACCESS_KEY,
+                    aws_secret_access_key = AWS_SECRET_KEY,
+                    endpoint_url = DYNAMO_URL,
+                    region_name = AWS_REGION,
+                    config = Config(
+                        max_pool_connections = DYNAMO_MAX_POOL,
+                        connect_timeout = CONNECT_TIMEOUT,
+                        read_timeout = READ_TIMEOUT,
+                        retries = { "mode": "adaptive", "max_attempts": DYNAMO_MAX_ATTEMPTS }
+                    )
+                ))
+    return _clients['dynamo']
+
+def async_elastic_client():
+    """
+    Function to get the shared AsyncElasticsearch client
+
+    Returns:
+        ES::elasticsearch.AsyncElasticsearch
+            The Elasticsearch client
+    """
+    if "elastic" not in _clients:
+        from elasticsearch import AsyncElasticsearch
+
+        _clients['elastic'] = AsyncElasticsearch(
+            [ ES_URI ],
+            maxsize = ES_MAX_POOL,
+            timeout = READ_TIMEOUT,
+            max_retries = ES_MAX_RETRIES,
+            retry_on_timeout = True,
+            http_compress = True
+        )
+    return _clients['elastic']
+
+def async_redis_client():
+    """
+    Function to get the shared async Redis client
+
+    Returns:
+        rds::redis.asyncio.Redis
+            The Redis client
+    """
+    if "redis" not in _clients:
+        from redis.asyncio import Redis, BlockingConnectionPool
+
+        pool = BlockingConnectionPool(
+            host = REDIS_HOST,
+            port = REDIS_PORT,
+            password = REDIS_PASSWORD,
+            max_connections = REDIS_MAX_POOL,
+            timeout = REDIS_POOL_TIMEOUT, # Seconds to wait for a free connection
+            socket_timeout = READ_TIMEOUT,
+            socket_connect_timeout = CONNECT_TIMEOUT,
+            socket_keepalive = True,
+            health_check_interval = 30
+        )
+        _clients['redis'] = Redis(connection_pool = pool)
+    return _clients['redis']
+
+async def close_async_clients():
+    """
+    Function to close every async client, eg. before the event loop stops
+    """
+    global _stack, _lock
+    if "elastic" in _clients:
+        await _clients.pop('elastic').close()
+    if "redis" in _clients:
+        await _clients.pop('redis').close()
+    if _stack is not None:
+        await _stack.aclose()
+        _stack = None
+    _clients.pop('dynamo', None)
+    _lock = None
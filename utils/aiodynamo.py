@@ -0,0 +1,344 @@
+"""
+Async Dynamo Utils
+==================
+
+asyncio versions of the functions in utils.dynamo
+
+Functions
+    - create_or_update_record
+    - update_record
+    - list_records
+    - iter_records
+    - get_record
+    - batch_get_records
+    - batch_write_records
+    - delete_record
+"""
+import asyncio
+
+from .aioclients import async_dynamo_client
+from .dynamo import (
+    BATCH_GET_LIMIT, BATCH_WRITE_LIMIT, BATCH_RETRIES,
+    deserialize_item, _serialize, _update_params, _scan_params, _unique, _chunks, _backoff_delay
+)
+
+_keyNames = {}
+
+def _condition_params(condition, params):
+    # Renders a boto3 condition object for the low-level client
+    from boto3.dynamodb.conditions import ConditionExpressionBuilder
+
+    built = ConditionExpressionBuilder().build_expression(condition)
+    params['ConditionExpression'] = built.condition_expression
+    params['ExpressionAttributeNames'] = { **params.get('ExpressionAttributeNames', {}), **built.attribute_name_placeholders }
+    params['ExpressionAttributeValues'] = { **params.get('ExpressionAttributeValues', {}), **built.attribute_value_placeholders }
+
+async def create_or_update_record(tableName, record, condition = None):
+    """
+    Function to create or update a record in DynamoDB
+
+    Params:
+        tableName::str
+            The table name to get the record
+        record::dict
+            The object to store
+        condition::boto3.dynamodb.conditions.ConditionBase
+            Condition the existing record must satisfy
+    Returns:
+        bool
+            If the record was inserted or not
+    """
+    if not tableName or not record:
+        return False
+    if not {'username', 'index'}.issubset(record):
+        return False
+
+    key = { "username": record['username'], "index": record['index'] }
+    changes = { k: v for k, v in record.items() if k not in key }
+    return await update_record(tableName, key, changes, condition = condition)
+
+async def update_record(tableName, key, changes = None, counters = None, condition = None):
+    """
+    Function to update attributes of a record in DynamoDB with one UpdateItem
+
+    Params:
+        tableName::str
+            The table name to update the record
+        key::dict
+            The primary key of the record
+        changes::dict
+            Attributes to set
+        counters::dict
+            Numeric attributes to increment atomically, by the given amount
+        condition::boto3.dynamodb.conditions.ConditionBase
+            Condition the existing record must satisfy
+    Returns:
+        bool
+            If the record was updated or not
+    """
+    if not tableName or not key or not isinstance(key, dict):
+        return False
+
+    try:
+        client = await async_dynamo_client()
+        params = _update_params(key, changes, counters)
+        if condition is not None:
+            _condition_params(condition, params)
+        params['Key'] = _serialize(params['Key'])
+        if 'ExpressionAttributeValues' in params:
+            params['ExpressionAttributeValues'] = _serialize(params['ExpressionAttributeValues'])
+        await client.update_item(TableName = tableName, **params)
+        return True
+
+    except Exception as e:
+        if type(e).__name__ == "ConditionalCheckFailedException":
+            print("Condition failed @ aiodynamo.update_record")
+            return False
+        print("Exception @ aiodynamo.update_record\n{}".format(e))
+        return None
+
+async def list_records(tableName, attributes = None, segments = 1):
+    """
+    Function to list all records from a DynamoDB table
+
+    Params:
+        tableName::str
+            The table name to get the records
+        attributes::[str]
+            Only fetch these attributes of each record
+        segments::int
+            Number of concurrent scan segments
+    Returns:
+        records::[dict]
+            The list of records stored in the table
+    """
+    if not tableName:
+        return False
+
+    try:
+        return [record async for record in iter_records(tableName, attributes, segments)]
+
+    except Exception as e:
+        if type(e).__name__ == "ResourceNotFoundException":
+            print("Table does not exist")
+            return False
+        print("Exception @ aiodynamo.list_records\n{}".format(e))
+        return None
+
+async def _scan_pages(params):
+    client = await async_dynamo_client()
+    res = await client.scan(**params)
+    yield res['Items']
+    while 'LastEvaluatedKey' in res:
+        res = await client.scan(**params, ExclusiveStartKey = res['LastEvaluatedKey'])
+        yield res['Items']
+
+async def _scan_segment(params, pages):
+    try:
+        async for page in _scan_pages(params):
+            await pages.put(page)
+        await pages.put(None)
+    except Exception as e:
+        await pages.put(e)
+
+async def iter_records(tableName, attributes = None, segments = 1, pageSize = None):
+    """
+    Async generator to stream records from a DynamoDB table page by page
+    With segments > 1 the segments are scanned concurrently and records are
+    yielded in no particular order
+
+    Params:
+        tableName::str
+            The table name to get the records
+        attributes::[str]
+            Only fetch these attributes of each record
+        segments::int
+            Number of concurrent scan segments
+        pageSize::int
+            Max items evaluated per Scan request
+    Yields:
+        record::dict
+            One record of the table
+    """
+    params = _scan_params(tableName, attributes, pageSize)
+    if segments <= 1:
+        async for page in _scan_pages(params):
+            for item in page:
+                yield deserialize_item(item)
+        return
+
+    # Bounded queue keeps at most a couple of pages per segment in memory
+    pages = asyncio.Queue(maxsize = segments * 2)
+    tasks = [
+        asyncio.ensure_future(_scan_segment({ **params, "Segment": segment, "TotalSegments": segments }, pages))
+        for segment in range(segments)
+    ]
+    try:
+        done = 0
+        while done < segments:
+            page = await pages.get()
+            if page is None:
+                done += 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                for item in page:
+                    yield deserialize_item(item)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def get_record(tableName, query):
+    """
+    Function to retrieve one record from DynamoDB table
+
+    Params:
+        tableName::str
+            The table name to get the record
+        query::dict
+            The query to fetch the record
+    Returns:
+        doc::dict
+            The record retrieved from the table
+    """
+    if not tableName or not query or not isinstance(query, dict):
+        return False
+
+    try:
+        client = await async_dynamo_client()
+        res = await client.get_item(TableName = tableName, Key = _serialize(query))
+        return deserialize_item(res['Item']) if 'Item' in res else None
+
+    except Exception as e:
+        print("Exception @ aiodynamo.get_record\n{}".format(e))
+        return None
+
+async def _key_names(tableName):
+    if tableName not in _keyNames:
+        client = await async_dynamo_client()
+        res = await client.describe_table(TableName = tableName)
+        _keyNames[tableName] = tuple(k['AttributeName'] for k in res['Table']['KeySchema'])
+    return _keyNames[tableName]
+
+async def _gather(chunks, worker, workers):
+    # Runs worker on every chunk, at most workers at a time
+    limit = asyncio.Semaphore(max(1, workers))
+
+    async def run(chunk):
+        async with limit:
+            return await worker(chunk)
+
+    return await asyncio.gather(*(run(c) for c in chunks))
+
+async def _batch_get_chunk(tableName, keys):
+    client = await async_dynamo_client()
+    request = { tableName: { "Keys": [_serialize(k) for k in keys] } }
+    docs = []
+    for attempt in range(BATCH_RETRIES):
+        res = await client.batch_get_item(RequestItems = request)
+        docs.extend(deserialize_item(item) for item in res['Responses'].get(tableName, []))
+        request = res.get('UnprocessedKeys')
+        if not request:
+            return docs
+        await asyncio.sleep(_backoff_delay(attempt))
+    raise Exception("{} keys left unprocessed".format(len(request[tableName]['Keys'])))
+
+async def _batch_write_chunk(tableName, records):
+    client = await async_dynamo_client()
+    request = { tableName: [{ "PutRequest": { "Item": _serialize(r) } } for r in records] }
+    for attempt in range(BATCH_RETRIES):
+        res = await client.batch_write_item(RequestItems = request)
+        request = res.get('UnprocessedItems')
+        if not request:
+            return True
+        await asyncio.sleep(_backoff_delay(attempt))
+    raise Exception("{} items left unprocessed".format(len(request[tableName])))
+
+async def batch_get_records(tableName, keys, workers = 1):
+    """
+    Function to retrieve many records from a DynamoDB table with BatchGetItem
+    Keys are sent in chunks of 100, unprocessed keys are retried with backoff
+    Duplicate keys are fetched once
+
+    Params:
+        tableName::str
+            The table name to get the records
+        keys::[dict]
+            The primary keys of the records
+        workers::int
+            Number of chunks fetched concurrently
+    Returns:
+        records::[dict]
+            The records found, in no particular order
+    """
+    if not tableName or not keys or not isinstance(keys, list):
+        return False
+
+    try:
+        chunks = _chunks(_unique(keys), BATCH_GET_LIMIT)
+        results = await _gather(chunks, lambda c: _batch_get_chunk(tableName, c), workers)
+        return [doc for docs in results for doc in docs]
+
+    except Exception as e:
+        if type(e).__name__ == "ResourceNotFoundException":
+            print("Table does not exist")
+            return False
+        print("Exception @ aiodynamo.batch_get_records\n{}".format(e))
+        return None
+
+async def batch_write_records(tableName, records, workers = 1):
+    """
+    Function to put many records into a DynamoDB table with BatchWriteItem
+    Records are sent in chunks of 25, unprocessed items are retried with backoff
+    If the same key appears more than once the last record is written
+
+    Params:
+        tableName::str
+            The table name to store the records
+        records::[dict]
+            The objects to store
+        workers::int
+            Number of chunks written concurrently
+    Returns:
+        bool
+            If all the records were stored or not
+    """
+    if not tableName or not records or not isinstance(records, list):
+        return False
+
+    try:
+        chunks = _chunks(_unique(records, await _key_names(tableName)), BATCH_WRITE_LIMIT)
+        await _gather(chunks, lambda c: _batch_write_chunk(tableName, c), workers)
+        return True
+
+    except Exception as e:
+        if type(e).__name__ == "ResourceNotFoundException":
+            print("Table does not exist")
+            return False
+        print("Exception @ aiodynamo.batch_write_records\n{}".format(e))
+        return None
+
+async def delete_record(tableName, query):
+    """
+    Function to delete a record from a DynamoDB table
+
+    Params:
+        tableName::str
+            The table name to delete the record from
+        query::dict
+            The primary key of the record
+    Returns:
+        bool
+            If the record was deleted or not
+    """
+    if not tableName or not query or not isinstance(query, dict):
+        return False
+
+    try:
+        client = await async_dynamo_client()
+        await client.delete_item(TableName = tableName, Key = _serialize(query))
+        return True
+
+    except Exception as e:
+        print("Exception @ aiodynamo.delete_record\n{}".format(e))
+        return None
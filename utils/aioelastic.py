@@ -0,0 +1,187 @@
+"""
+Async Elastic Utils
+===================
+
+asyncio versions of the functions in utils.elastic
+They send the same requests, built by utils.elastic, with the async client
+Bulk requests are sent one after another, there is no threads option
+
+Functions
+    - create_or_update_document
+    - list_documents
+    - search_page
+    - iter_documents
+    - aggregate
+    - suggest
+    - get_document
+    - get_documents
+    - search_documents_by_id
+    - update_document
+    - script_update_document
+    - put_script
+    - delete_document
+    - streaming_bulk
+    - bulk_index
+    - put_index_template
+    - put_mapping
+    - create_index
+    - list_indexes
+    - get_alias_indexes
+    - update_aliases
+    - find_document_index
+    - count_documents
+    - delete_index
+    - update_by_query
+    - delete_by_query
+    - task_status
+"""
+from functools import wraps
+
+from . import elastic
+from .aioclients import async_elastic_client
+from .elastic import (
+    BULK_CHUNK_SIZE, BULK_CHUNK_BYTES,
+    _method, _open_pit, _next_page, _close_pit, _set_refresh, _resume_refresh, _bulk_action, _bulk_params, _count_bulk
+)
+
+async def _run(steps):
+    # utils.elastic._run, awaiting each request
+    try:
+        request = next(steps)
+        while True:
+            name, params = request
+            try:
+                res = await _method(async_elastic_client(), name)(**params)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(res)
+    except StopIteration as stop:
+        return stop.value
+
+def _mirror(function):
+    @wraps(function)
+    async def call(*args, **kwargs):
+        return await _run(function.steps(*args, **kwargs))
+    return call
+
+create_or_update_document = _mirror(elastic.create_or_update_document)
+list_documents = _mirror(elastic.list_documents)
+search_page = _mirror(elastic.search_page)
+aggregate = _mirror(elastic.aggregate)
+suggest = _mirror(elastic.suggest)
+get_document = _mirror(elastic.get_document)
+get_documents = _mirror(elastic.get_documents)
+search_documents_by_id = _mirror(elastic.search_documents_by_id)
+update_document = _mirror(elastic.update_document)
+script_update_document = _mirror(elastic.script_update_document)
+put_script = _mirror(elastic.put_script)
+delete_document = _mirror(elastic.delete_document)
+put_index_template = _mirror(elastic.put_index_template)
+put_mapping = _mirror(elastic.put_mapping)
+create_index = _mirror(elastic.create_index)
+list_indexes = _mirror(elastic.list_indexes)
+get_alias_indexes = _mirror(elastic.get_alias_indexes)
+update_aliases = _mirror(elastic.update_aliases)
+find_document_index = _mirror(elastic.find_document_index)
+count_documents = _mirror(elastic.count_documents)
+delete_index = _mirror(elastic.delete_index)
+update_by_query = _mirror(elastic.update_by_query)
+delete_by_query = _mirror(elastic.delete_by_query)
+task_status = _mirror(elastic.task_status)
+
+async def iter_documents(index, query = {}, size = 500):
+    """
+    Async generator to stream every matching document of an index page by page
+
+    Params:
+        index::str
+            ES index to search for documents
+        query::dict
+            Query object to search
+        size::int
+            Documents per request
+    Yields:
+        hit::dict
+            One document retrieved from ES index
+    """
+    pitID = await _run(_open_pit(index))
+    after = None
+    try:
+        while True:
+            hits, pitID = await _run(_next_page(query, size, pitID, after))
+            for hit in hits:
+                yield hit
+            if len(hits) < size:
+                return
+            after = hits[-1]['sort']
+    finally:
+        await _run(_close_pit(pitID))
+
+def streaming_bulk(docs, chunkSize = BULK_CHUNK_SIZE, maxChunkBytes = BULK_CHUNK_BYTES, opType = "index"):
+    """
+    Async generator to index documents with the bulk API
+    Requests are split by document count and byte size
+
+    Params:
+        docs::iterable((str, str, dict))
+            (index, ID, body) of each document, sync or async iterable
+        chunkSize::int
+            Max documents per request
+        maxChunkBytes::int
+            Max bytes per request
+        opType::str
+            "index" to create or replace, "create" to fail if the ID exists
+    Yields:
+        ok::bool
+            If the document was indexed or not
+        item::dict
+            The bulk response item of the document
+    """
+    from elasticsearch.helpers import async_streaming_bulk
+
+    async def actions():
+        if hasattr(docs, "__aiter__"):
+            async for index, ID, body in docs:
+                yield _bulk_action(opType, index, ID, body)
+        else:
+            for index, ID, body in docs:
+                yield _bulk_action(opType, index, ID, body)
+
+    return async_streaming_bulk(async_elastic_client(), actions(), max_retries = 3, **_bulk_params(chunkSize, maxChunkBytes))
+
+async def bulk_index(docs, chunkSize = BULK_CHUNK_SIZE, maxChunkBytes = BULK_CHUNK_BYTES, pauseRefresh = None, opType = "index"):
+    """
+    Function to index many documents with the bulk API
+
+    Params:
+        docs::iterable((str, str, dict))
+            (index, ID, body) of each document, sync or async iterable
+        chunkSize::int
+            Max documents per request
+        maxChunkBytes::int
+            Max bytes per request
+        pauseRefresh::[str]
+            Indexes to stop refreshing during the load, refreshed once at the end
+        opType::str
+            "index" to create or replace, "create" to fail if the ID exists
+    Returns:
+        indexed::int
+            Number of documents indexed
+        errors::[dict]
+            The bulk response items of the failed documents
+    """
+    try:
+        if pauseRefresh:
+            await _run(_set_refresh(pauseRefresh, "-1"))
+        try:
+            counts = { "indexed": 0, "errors": [] }
+            async for ok, item in streaming_bulk(docs, chunkSize, maxChunkBytes, opType):
+                _count_bulk(counts, ok, item)
+        finally:
+            if pauseRefresh:
+                await _run(_resume_refresh(pauseRefresh))
+        return counts
+
+    except Exception as e:
+        return e
@@ -0,0 +1,362 @@
+"""
+Async Redis Utils
+=================
+
+asyncio versions of the functions in utils.redis
+
+Functions:
+    - set_data
+    - get_data
+    - delete_key
+    - get_many
+    - set_many
+    - delete_many
+    - batch
+    - add_members
+    - remove_members
+    - is_member
+    - get_members
+    - key_exists
+    - increment
+    - set_if_missing
+"""
+import time
+from base64 import urlsafe_b64encode
+from contextlib import asynccontextmanager
+
+from .codec import encode, decode
+from .aioclients import async_redis_client
+
+async def set_data(data, key = None, ttl = None, nx = False):
+    """
+    Function to create a Redis key
+
+    Params:
+        data::dict|list
+            The data to be cached
+        key::str
+            The key to store the data in
+        ttl::int
+            Seconds after which Redis expires the key
+        nx::bool
+            Only store the data if the key does not exist
+    Returns:
+        cacheKey::str
+            The cacheKey in which the data has been stored, False if nx
+            is set and the key already exists
+    """
+    if not data:
+        return False
+    if not isinstance(data, dict) and not isinstance(data, list):
+        return False
+
+    try:
+        if key is not None and key:
+            cacheKey = key
+        elif isinstance(data, dict) and "username" in data:
+            cacheKey = "UserCache_" + urlsafe_b64encode(data['username'].encode('ascii')).decode()
+        else:
+            cacheKey = "MiscCache_" + str(int(time.time()))
+        if not await async_redis_client().set(cacheKey, encode(data), ex = ttl, nx = nx):
+            return False
+        return cacheKey
+
+    except Exception as e:
+        print("Exception @ aioredis.set_data\n{}".format(e))
+        return None
+
+async def get_data(key):
+    """
+    Retrieve data from Redis
+
+    Params:
+        key::str
+            The cache key to fetch
+    Returns:
+        data::dict
+            The data stored in the key
+    """
+    if not key:
+        return False
+
+    try:
+        return decode(await async_redis_client().get(key))
+
+    except Exception as e:
+        print("Exception @ aioredis.get_data\n{}".format(e))
+        return None
+
+async def delete_key(key):
+    """
+    Function to delete a key in Redis
+
+    Params:
+        key::str
+            The cache key to delete
+    Returns:
+        bool
+            If the cache has been deleted or not
+    """
+    if not key:
+        return False
+
+    try:
+        await async_redis_client().delete(key)
+        return True
+
+    except Exception as e:
+        print("Exception @ aioredis.delete_key\n{}".format(e))
+        return None
+
+async def get_many(keys):
+    """
+    Retrieve many keys from Redis with one MGET
+
+    Params:
+        keys::[str]
+            The cache keys to fetch
+    Returns:
+        data::[dict]
+            The data stored in each key, None for missing keys
+    """
+    if not keys:
+        return False
+
+    try:
+        return [decode(raw) for raw in await async_redis_client().mget(keys)]
+
+    except Exception as e:
+        print("Exception @ aioredis.get_many\n{}".format(e))
+        return None
+
+async def set_many(data, ttl = None):
+    """
+    Function to store many keys in Redis in one round trip
+
+    Params:
+        data::dict
+            The data to be cached, by key
+        ttl::int|dict
+            Seconds after which Redis expires the keys, or per key
+    Returns:
+        bool
+            If the keys have been stored or not
+    """
+    if not data or not isinstance(data, dict):
+        return False
+
+    try:
+        if ttl is None:
+            await async_redis_client().mset({ key: encode(val) for key, val in data.items() })
+            return True
+        pipe = async_redis_client().pipeline(transaction = False)
+        for key, val in data.items():
+            pipe.set(key, encode(val), ex = ttl.get(key) if isinstance(ttl, dict) else ttl)
+        await pipe.execute()
+        return True
+
+    except Exception as e:
+        print("Exception @ aioredis.set_many\n{}".format(e))
+        return None
+
+async def delete_many(keys):
+    """
+    Function to delete many keys in Redis with one DEL
+
+    Params:
+        keys::[str]
+            The cache keys to delete
+    Returns:
+        bool
+            If the keys have been deleted or not
+    """
+    if not keys:
+        return False
+
+    try:
+        await async_redis_client().delete(*keys)
+        return True
+
+    except Exception as e:
+        print("Exception @ aioredis.delete_many\n{}".format(e))
+        return None
+
+@asynccontextmanager
+async def batch():
+    """
+    Async context manager sending every command of the block in one round trip
+    Results are filled in when the block exits
+
+        async with batch() as (pipe, results):
+            pipe.get("a")
+            pipe.sismember("b", "c")
+        a, c = results
+
+    Yields:
+        pipe::redis.asyncio.client.Pipeline
+            Queue commands on it
+        results::list
+            The replies, in order, once the block has exited
+    """
+    pipe = async_redis_client().pipeline(transaction = False)
+    results = []
+    yield pipe, results
+    results.extend(await pipe.execute())
+
+async def add_members(key, members):
+    """
+    Function to add members to a Redis set
+
+    Params:
+        key::str
+            The set key
+        members::[str]
+            The members to add
+    Returns:
+        added::int
+            The number of members that were not already in the set
+    """
+    if not key or not members:
+        return False
+
+    try:
+        return await async_redis_client().sadd(key, *members)
+
+    except Exception as e:
+        print("Exception @ aioredis.add_members\n{}".format(e))
+        return None
+
+async def remove_members(key, members):
+    """
+    Function to remove members from a Redis set
+
+    Params:
+        key::str
+            The set key
+        members::[str]
+            The members to remove
+    Returns:
+        removed::int
+            The number of members removed from the set
+    """
+    if not key or not members:
+        return False
+
+    try:
+        return await async_redis_client().srem(key, *members)
+
+    except Exception as e:
+        print("Exception @ aioredis.remove_members\n{}".format(e))
+        return None
+
+async def is_member(key, member):
+    """
+    Function to check if a member is present in a Redis set
+
+    Params:
+        key::str
+            The set key
+        member::str
+            The member to look up
+    Returns:
+        bool
+            If the member is in the set or not
+    """
+    if not key or not member:
+        return False
+
+    try:
+        return bool(await async_redis_client().sismember(key, member))
+
+    except Exception as e:
+        print("Exception @ aioredis.is_member\n{}".format(e))
+        return None
+
+async def get_members(key):
+    """
+    Function to get all members of a Redis set
+
+    Params:
+        key::str
+            The set key
+    Returns:
+        members::[str]
+            The members of the set
+    """
+    if not key:
+        return False
+
+    try:
+        return [m.decode() for m in await async_redis_client().smembers(key)]
+
+    except Exception as e:
+        print("Exception @ aioredis.get_members\n{}".format(e))
+        return None
+
+async def key_exists(key):
+    """
+    Function to check if a key exists in Redis
+
+    Params:
+        key::str
+            The cache key to check
+    Returns:
+        bool
+            If the key exists or not
+    """
+    if not key:
+        return False
+
+    try:
+        return await async_redis_client().exists(key) > 0
+
+    except Exception as e:
+        print("Exception @ aioredis.key_exists\n{}".format(e))
+        return None
+
+async def increment(key, amount = 1):
+    """
+    Function to atomically increment an integer key in Redis
+    Missing keys start at 0
+
+    Params:
+        key::str
+            The counter key
+        amount::int
+            The amount to add
+    Returns:
+        value::int
+            The value after the increment
+    """
+    if not key:
+        return False
+
+    try:
+        return await async_redis_client().incrby(key, amount)
+
+    except Exception as e:
+        print("Exception @ aioredis.increment\n{}".format(e))
+        return None
+
+async def set_if_missing(key, value):
+    """
+    Function to set a Redis key only if it does not exist yet
+
+    Params:
+        key::str
+            The cache key to set
+        value::str|int
+            The raw value to store
+    Returns:
+        bool
+            If the key was set or not
+    """
+    if not key:
+        return False
+
+    try:
+        return bool(await async_redis_client().setnx(key, value))
+
+    except Exception as e:
+        print("Exception @ aioredis.set_if_missing\n{}".format(e))
+        return None
@@ -0,0 +1,165 @@
+"""
+Archive Utils
+=============
+
+Streaming export / import of Elasticsearch indexes as gzipped NDJSON
+One line per document: { "_id": ..., "_source": ... }
+Memory use is bounded by one page on export and one bulk chunk on import,
+whatever the size of the index
+
+Functions
+    - export_index
+    - import_index
+    - archive_year
+
+Usage
+    python -m utils.archive export <index> <file>
+    python -m utils.archive import <file> <index> [--threads N]
+    python -m utils.archive archive <journeys|spottings> <year> <file> [--delete]
+"""
+import gzip
+import json
+import time
+import argparse
+
+from .indexes import yearly_index
+from .elastic import iter_documents, bulk_index, create_index, count_documents, delete_index
+
+def export_index(index, path, size = 1000):
+    """
+    Function to write every document of an index to a gzipped NDJSON file
+
+    Params:
+        index::str
+            ES index to export
+        path::str
+            The file to write
+        size::int
+            Documents per request
+    Returns:
+        count::int
+            Number of documents exported
+    """
+    if not index or not path:
+        return False
+
+    try:
+        count = 0
+        with gzip.open(path, "wt", encoding = "utf-8") as file:
+            # No sort besides the point in time tiebreaker, the cheapest order
+            for hit in iter_documents(index, { "sort": [] }, size):
+                file.write(json.dumps({ "_id": hit['_id'], "_source": hit['_source'] }, separators = (",", ":")))
+                file.write("\n")
+                count += 1
+        return count
+
+    except Exception as e:
+        print("Exception @ export_index\n{}".format(e))
+        return None
+
+def _read_lines(path, index):
+    with gzip.open(path, "rt", encoding = "utf-8") as file:
+        for line in file:
+            if line.strip():
+                doc = json.loads(line)
+                yield index, doc['_id'], doc['_source']
+
+def import_index(path, index, threads = 1):
+    """
+    Function to load a gzipped NDJSON export into an index with the bulk API
+    Refresh is paused on the index during the load
+
+    Params:
+        path::str
+            The file to read
+        index::str
+            ES index to load the documents into
+        threads::int
+            Number of bulk requests sent in parallel
+    Returns:
+        indexed::int
+            Number of documents indexed
+        errors::[dict]
+            The documents which could not be indexed
+    """
+    if not path or not index:
+        return False
+
+    try:
+        res = create_index(index)
+        if isinstance(res, Exception):
+            raise res
+        res = bulk_index(_read_lines(path, index), threads = threads, pauseRefresh = [index])
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+    except Exception as e:
+        print("Exception @ import_index\n{}".format(e))
+        return None
+
+def archive_year(entity, year, path, delete = False):
+    """
+    Function to export a closed yearly index, optionally deleting it after
+    The index is only deleted if the export holds every document
+
+    Params:
+        entity::str
+            "journeys" or "spottings"
+        year::int
+            The year to archive, must be before the current year
+        path::str
+            The file to write
+        delete::bool
+            If the index must be deleted after the export
+    Returns:
+        count::int
+            Number of documents archived
+    """
+    if not entity or not year or int(year) >= int(time.strftime("%Y")):
+        return False
+
+    try:
+        index = yearly_index(entity, year)
+        expected = count_documents(index)
+        if isinstance(expected, Exception):
+            raise expected
+        count = export_index(index, path)
+        if count is None or count is False:
+            return None
+        if count != expected:
+            print("Exported {} of {} documents @ archive_year, index kept".format(count, expected))
+            return False
+        if delete:
+            res = delete_index(index)
+            if isinstance(res, Exception):
+                raise res
+        return count
+
+    except Exception as e:
+        print("Exception @ archive_year\n{}".format(e))
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Export, import and archive Elasticsearch indexes")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    exportCmd = commands.add_parser("export")
+    exportCmd.add_argument("index")
+    exportCmd.add_argument("file")
+    importCmd = commands.add_parser("import")
+    importCmd.add_argument("file")
+    importCmd.add_argument("index")
+    importCmd.add_argument("--threads", type = int, default = 1)
+    archiveCmd = commands.add_parser("archive")
+    archiveCmd.add_argument("entity", choices = ["journeys", "spottings"])
+    archiveCmd.add_argument("year", type = int)
+    archiveCmd.add_argument("file")
+    archiveCmd.add_argument("--delete", action = "store_true")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(export_index(args.index, args.file))
+    elif args.command == "import":
+        print(import_index(args.file, args.index, args.threads))
+    else:
+        print(archive_year(args.entity, args.year, args.file, args.delete))
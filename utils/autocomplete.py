@@ -0,0 +1,211 @@
+"""
+Autocomplete Utils
+==================
+
+Prefix autocomplete for train names & numbers, loco classes & sheds and
+stations, backed by an Elasticsearch completion suggester
+Recent answers are kept per worker for a minute, so repeated keystrokes
+across users rarely leave the process
+
+Functions
+    - create_autocomplete_index
+    - add_suggestions
+    - rebuild_suggestions
+    - suggest_values
+"""
+import time
+from threading import Lock
+from collections import OrderedDict
+
+from .dynamo import iter_records
+from .indexes import read_alias, runtime_fields
+from .elastic import create_index, bulk_index, aggregate, suggest
+
+INDEX = "autocomplete"
+KINDS = { "train_name", "train_number", "loco_class", "loco_shed", "station" }
+
+MAPPING = {
+    "settings": { "number_of_shards": 1, "number_of_replicas": 1 },
+    "mappings": {
+        "dynamic": False,
+        "properties": {
+            "kind": { "type": "keyword" },
+            "value": { "type": "keyword" },
+            "suggest": {
+                "type": "completion",
+                "contexts": [{ "name": "kind", "type": "category", "path": "kind" }]
+            }
+        }
+    }
+}
+
+# Where each kind is found in the spotting / journey indexes
+# Fields are read from _source, older indexes map them as text
+SOURCES = [
+    ("spottings", "train_name", "train_name"),
+    ("spottings", "train_number", "train_number"),
+    ("spottings", "loco_class", "loco_class"),
+    ("spottings", "loco_shed", "loco_shed"),
+    ("journeys", "train_name", "train_name"),
+    ("journeys", "train_number", "train_number"),
+    ("journeys", "loco_class", "loco_class"),
+    ("journeys", "loco_shed", "loco_shed"),
+    ("journeys", "from", "station"),
+    ("journeys", "to", "station")
+]
+
+LOCAL_TTL = 60 # Seconds an answer is reused by this worker
+LOCAL_SIZE = 4096 # Max answers held by this worker
+
+_local = OrderedDict()
+_lock = Lock()
+
+def create_autocomplete_index():
+    """
+    Function to create the autocomplete index
+
+    Returns:
+        bool
+            If the index was created or not
+    """
+    try:
+        res = create_index(INDEX, MAPPING)
+        if isinstance(res, Exception):
+            raise res
+        return True
+
+    except Exception as e:
+        print("Exception @ create_autocomplete_index\n{}".format(e))
+        return None
+
+def _suggestion(kind, value):
+    value = str(value).strip()
+    return INDEX, "{}:{}".format(kind, value), {
+        "kind": kind,
+        "value": value,
+        "suggest": { "input": [value] + value.split()[1:], "contexts": { "kind": [kind] } }
+    }
+
+def add_suggestions(kind, values):
+    """
+    Function to add values to the autocomplete index
+    Values already present are overwritten, not duplicated
+
+    Params:
+        kind::str
+            One of KINDS
+        values::[str]
+            The values to suggest
+    Returns:
+        indexed::int
+            Number of values indexed
+        errors::[dict]
+            The values which could not be indexed
+    """
+    if kind not in KINDS or not values:
+        return False
+
+    try:
+        res = bulk_index(_suggestion(kind, v) for v in values if str(v).strip())
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+    except Exception as e:
+        print("Exception @ add_suggestions\n{}".format(e))
+        return None
+
+def _distinct_values(index, field):
+    # Pages through every distinct value with a composite aggregation
+    # Fails if any shard fails, a partial rebuild would look complete
+    runtime = runtime_fields([field])
+    after = None
+    while True:
+        composite = { "size": 1000, "sources": [{ "value": { "terms": { "field": field } } }] }
+        if after:
+            composite['after'] = after
+        res = aggregate(index, { "match_all": {} }, { "values": { "composite": composite } }, runtime)
+        if isinstance(res, Exception):
+            raise res
+        buckets = res['aggregations']['values']['buckets']
+        for b in buckets:
+            yield b['key']['value']
+        after = res['aggregations']['values'].get('after_key')
+        if not buckets or not after:
+            return
+
+def rebuild_suggestions():
+    """
+    Function to load every known value into the autocomplete index
+    Values come from the spotting & journey indexes and the "trains" table
+
+    Returns:
+        indexed::int
+            Number of values indexed
+        errors::[dict]
+            The values which could not be indexed
+    """
+    try:
+        def suggestions():
+            for entity, field, kind in SOURCES:
+                for value in _distinct_values(read_alias(entity), field):
+                    yield _suggestion(kind, value)
+            for record in iter_records("trains", ["train_name"]):
+                yield _suggestion("train_name", record['train_name'])
+        res = bulk_index(suggestions(), pauseRefresh = [INDEX])
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+    except Exception as e:
+        print("Exception @ rebuild_suggestions\n{}".format(e))
+        return None
+
+def suggest_values(kind, prefix, size = 10):
+    """
+    Function to autocomplete a value from its first characters
+
+    Params:
+        kind::str
+            One of KINDS
+        prefix::str
+            What the user typed so far
+        size::int
+            Max suggestions
+    Returns:
+        values::[str]
+            The suggested values
+    """
+    if kind not in KINDS or not prefix:
+        return False
+
+    cacheKey = (kind, prefix.lower(), size)
+    with _lock:
+        entry = _local.get(cacheKey)
+        if entry and time.time() - entry[1] < LOCAL_TTL:
+            _local.move_to_end(cacheKey)
+            return entry[0]
+
+    try:
+        res = suggest(INDEX, { "values": {
+            "prefix": prefix,
+            "completion": {
+                "field": "suggest",
+                "size": size,
+                "contexts": { "kind": [kind] }
+            }
+        } }, ["value"])
+        if isinstance(res, Exception):
+            raise res
+        # The matched input can be a single word, the full value is in _source
+        values = list(dict.fromkeys(option['_source']['value'] for option in res['values'][0]['options']))
+        with _lock:
+            _local[cacheKey] = (values, time.time())
+            _local.move_to_end(cacheKey)
+            while len(_local) > LOCAL_SIZE:
+                _local.popitem(last = False)
+        return values
+
+    except Exception as e:
+        print("Exception @ suggest_values\n{}".format(e))
+        return None
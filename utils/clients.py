@@ -0,0 +1,133 @@
+"""
+Client Utils
+============
+
+Shared clients for DynamoDB, Elasticsearch and Redis
+Each client is built once per process with a tuned connection pool, so
+every utility module reuses the same warm connections
+Clients and their libraries are only loaded on first use, which keeps cold
+starts cheap for handlers that touch a single backend
+
+Functions
+    - dynamo_resource
+    - dynamo_client
+    - dynamo_table
+    - elastic_client
+    - redis_client
+"""
+from threading import Lock
+from functools import lru_cache
+
+from constants import (
+    AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION, DYNAMO_URL, ES_URI,
+    REDIS_HOST, REDIS_PORT, REDIS_PASSWORD,
+    DYNAMO_MAX_POOL, DYNAMO_MAX_ATTEMPTS, ES_MAX_POOL, ES_MAX_RETRIES, REDIS_MAX_POOL, REDIS_POOL_TIMEOUT,
+    CONNECT_TIMEOUT, READ_TIMEOUT
+)
+
+_tables = {}
+_tablesLock = Lock()
+
+@lru_cache(maxsize = None)
+def dynamo_resource():
+    """
+    Function to get the shared DynamoDB resource
+
+    Returns:
+        ddb::boto3.resources.base.ServiceResource
+            The DynamoDB resource
+    """
+    import boto3
+    from botocore.config import Config
+
+    options = {
+        "max_pool_connections": DYNAMO_MAX_POOL,
+        "connect_timeout": CONNECT_TIMEOUT,
+        "read_timeout": READ_TIMEOUT,
+        "retries": { "mode": "adaptive", "max_attempts": DYNAMO_MAX_ATTEMPTS }
+    }
+    if "tcp_keepalive" in Config.OPTION_DEFAULTS:
+        # Only available on newer botocore releases
+        options['tcp_keepalive'] = True
+    return boto3.resource(
+        'dynamodb',
+        aws_access_key_id = AWS_ACCESS_KEY,
+        aws_secret_access_key = AWS_SECRET_KEY,
+        endpoint_url = DYNAMO_URL,
+        region_name = AWS_REGION,
+        config = Config(**options)
+    )
+
+def dynamo_client():
+    """
+    Function to get the shared low-level DynamoDB client
+    It is the client of the shared resource, so both use one pool
+
+    Returns:
+        client::botocore.client.DynamoDB
+            The DynamoDB client
+    """
+    return dynamo_resource().meta.client
+
+def dynamo_table(tableName):
+    """
+    Function to get a cached DynamoDB Table handle
+
+    Params:
+        tableName::str
+            The table name
+    Returns:
+        table::dynamodb.Table
+            The Table handle
+    """
+    table = _tables.get(tableName)
+    if table is None:
+        with _tablesLock:
+            table = _tables.setdefault(tableName, dynamo_resource().Table(tableName))
+    return table
+
+@lru_cache(maxsize = None)
+def elastic_client():
+    """
+    Function to get the shared Elasticsearch client
+
+    Returns:
+        ES::elasticsearch.Elasticsearch
+            The Elasticsearch client
+    """
+    from elasticsearch import Elasticsearch
+
+    return Elasticsearch(
+        [ ES_URI ],
+        maxsize = ES_MAX_POOL,
+        timeout = READ_TIMEOUT,
+        max_retries = ES_MAX_RETRIES,
+        retry_on_timeout = True,
+        http_compress = True
+    )
+
+@lru_cache(maxsize = None)
+def redis_client():
+    """
+    Function to get the shared Redis client
+    When every pooled connection is busy, callers wait for one to be released
+    instead of failing
+
+    Returns:
+        rds::redis.Redis
+            The Redis client
+    """
+    from redis import Redis, BlockingConnectionPool
+
+    pool = BlockingConnectionPool(
+        host = REDIS_HOST,
+        port = REDIS_PORT,
+        password = REDIS_PASSWORD,
+        max_connections = REDIS_MAX_POOL,
+        timeout = REDIS_POOL_TIMEOUT, # Seconds to wait for a free connection
+        socket_timeout = READ_TIMEOUT,
+        socket_connect_timeout = CONNECT_TIMEOUT,
+        socket_keepalive = True,
+        health_check_interval = 30
+    )
+    return Redis(connection_pool = pool)
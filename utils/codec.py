@@ -0,0 +1,98 @@
+"""
+Codec Utils
+===========
+
+Encoding of values cached in Redis
+Values are JSON, serialized with orjson when it is installed
+Values over COMPRESS_THRESHOLD bytes are zlib compressed and prefixed with
+a marker, so plain JSON written before the codec existed still decodes
+Every writer produces the same bytes whatever is installed, lz4 values are
+only read, when lz4 is installed
+
+Format
+    {...} / [...]       Plain JSON
+    \x00Z + data        zlib compressed JSON
+    \x00L + data        lz4 frame compressed JSON, read only
+
+Functions
+    - encode
+    - decode
+"""
+import json
+import zlib
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+COMPRESS_THRESHOLD = 4096 # Bytes, smaller values are not worth compressing
+MARKER = b"\x00"
+ZLIB = b"Z"
+LZ4 = b"L"
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError("Type is not JSON serializable: {}".format(type(obj).__name__))
+
+def _dumps(obj):
+    if orjson is not None:
+        # Non-str keys are turned into strings, like json.dumps does
+        return orjson.dumps(obj, default = _default, option = orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default = _default, separators = (",", ":")).encode()
+
+def _loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def encode(obj, threshold = COMPRESS_THRESHOLD):
+    """
+    Function to encode a value for Redis
+
+    Params:
+        obj::dict|list
+            The value to encode
+        threshold::int
+            Size in bytes above which the value is compressed
+    Returns:
+        raw::bytes
+            The encoded value
+    """
+    raw = _dumps(obj)
+    if len(raw) <= threshold:
+        return raw
+    return MARKER + ZLIB + zlib.compress(raw, 1) # Fastest level, most of the size win
+
+def decode(raw):
+    """
+    Function to decode a value read from Redis, in any supported format
+
+    Params:
+        raw::bytes
+            The stored value
+    Returns:
+        obj::dict|list
+            The decoded value, None for a missing key
+    """
+    if raw is None:
+        return None
+    if raw[:1] != MARKER:
+        return _loads(raw)
+    kind = raw[1:2]
+    if kind == ZLIB:
+        return _loads(zlib.decompress(raw[2:]))
+    if kind == LZ4:
+        if lz4 is None:
+            raise ValueError("lz4 is needed to decode this value")
+        return _loads(lz4.decompress(raw[2:]))
+    raise ValueError("Unknown value format {!r}".format(kind))
@@ -6,34 +6,44 @@ All utility functions for interactions with DynamoDB
 
 Functions
     - ensure_json
+    - deserialize_item
     - create_user_table
     - create_or_update_record
+    - update_record
     - list_tables
     - list_records
+    - iter_records
     - get_record
+    - batch_get_records
+    - batch_write_records
     - delete_table
     - delete_record
     - check_active
 """
-import boto3
+import time
+import random
 from decimal import Decimal
+from threading import Event
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-from constants import AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION, DYNAMO_URL
-
-ddb = boto3.resource(
-    'dynamodb',
-    aws_access_key_id = AWS_ACCESS_KEY,
-    aws_secret_access_key = AWS_SECRET_KEY,
-    endpoint_url = DYNAMO_URL,
-    region_name = AWS_REGION
-)
-client = boto3.client(
-    'dynamodb',
-    aws_access_key_id = AWS_ACCESS_KEY,
-    aws_secret_access_key = AWS_SECRET_KEY,
-    endpoint_url = DYNAMO_URL,
-    region_name = AWS_REGION
-)
+from .clients import dynamo_resource, dynamo_client, dynamo_table
+
+BATCH_GET_LIMIT = 100 # Max keys per BatchGetItem
+BATCH_WRITE_LIMIT = 25 # Max items per BatchWriteItem
+BATCH_RETRIES = 8 # Attempts for unprocessed keys / items
+
+class _NoMatch(Exception):
+    """Never raised, stands in for an exception class that is unavailable"""
+
+def _error(name):
+    # Exception class of the DynamoDB client, resolved inside except clauses
+    # so it must not raise when the client itself cannot be built
+    try:
+        return getattr(dynamo_client().exceptions, name)
+    except Exception:
+        return _NoMatch
 
 def ensure_json(obj):
     """
@@ -62,6 +72,49 @@ def ensure_json(obj):
     else:
         return obj
 
+def _number(val):
+    try:
+        return int(val)
+    except ValueError:
+        num = Decimal(val)
+        return int(num) if num % 1 == 0 else float(num)
+
+def _value(attr):
+    for kind, val in attr.items():
+        if kind == "S":
+            return val
+        if kind == "N":
+            return _number(val)
+        if kind == "M":
+            return { k: _value(v) for k, v in val.items() }
+        if kind == "L":
+            return [_value(v) for v in val]
+        if kind == "BOOL":
+            return val
+        if kind == "NULL":
+            return None
+        if kind == "SS" or kind == "BS":
+            return set(val)
+        if kind == "NS":
+            return set(_number(n) for n in val)
+        if kind == "B":
+            return val
+        raise TypeError("Unknown DynamoDB type {}".format(kind))
+
+def deserialize_item(item):
+    """
+    Function to convert a low-level DynamoDB item into a JSON serializable dict
+    Does the job of TypeDeserializer + ensure_json in a single pass
+
+    Params:
+        item::dict
+            Item in DynamoDB wire format, eg. { "age": { "N": "20" } }
+    Returns:
+        record::dict
+            The plain record, eg. { "age": 20 }
+    """
+    return { k: _value(v) for k, v in item.items() }
+
 def create_user_table():
     """
     Function to create the "users" table in DynamoDB
@@ -71,7 +124,7 @@ def create_user_table():
             If the table was created or not
     """
     try:
-        table = ddb.create_table(
+        table = dynamo_resource().create_table(
             TableName = "users",
             KeySchema = [
                 {
@@ -100,7 +153,7 @@ def create_user_table():
         )
         return True
 
-    except client.exceptions.ResourceNotFoundException:
+    except _error("ResourceNotFoundException"):
         print("Table does not exist")
         return False
 
@@ -117,7 +170,7 @@ def create_train_table():
             If the table was created or not
     """
     try:
-        table = ddb.create_table(
+        table = dynamo_resource().create_table(
             TableName = "trains",
             KeySchema = [
                 {
@@ -146,7 +199,7 @@ def create_train_table():
         )
         return True
 
-    except client.exceptions.ResourceNotFoundException:
+    except _error("ResourceNotFoundException"):
         print("Table does not exist")
         return False
 
@@ -154,7 +207,7 @@ def create_train_table():
         print("Exception @ create_user_table\n{}".format(e))
         return None
 
-def create_or_update_record(tableName, record):
+def create_or_update_record(tableName, record, condition = None):
     """
     Function to create or update a record in DynamoDB
 
@@ -163,6 +216,8 @@ def create_or_update_record(tableName, record):
             The table name to get the record
         record::dict
             The object to store
+        condition::boto3.dynamodb.conditions.ConditionBase
+            Condition the existing record must satisfy
 
     Returns:
         bool
@@ -173,25 +228,79 @@ def create_or_update_record(tableName, record):
     if not {'username', 'index'}.issubset(record):
         return False
 
+    key = { "username": record['username'], "index": record['index'] }
+    changes = { k: v for k, v in record.items() if k not in key }
+    return update_record(tableName, key, changes, condition = condition)
+
+def _update_params(key, changes, counters):
+    # SET for changed attributes, ADD for counters, placeholders for every name
+    names = {}
+    values = {}
+    setExpr = []
+    addExpr = []
+    for i, (attr, val) in enumerate((changes or {}).items()):
+        names["#s{}".format(i)] = attr
+        values[":s{}".format(i)] = val
+        setExpr.append("#s{0} = :s{0}".format(i))
+    for i, (attr, val) in enumerate((counters or {}).items()):
+        names["#c{}".format(i)] = attr
+        values[":c{}".format(i)] = val
+        addExpr.append("#c{0} :c{0}".format(i))
+
+    params = { "Key": key }
+    expr = []
+    if setExpr:
+        expr.append("SET " + ", ".join(setExpr))
+    if addExpr:
+        expr.append("ADD " + ", ".join(addExpr))
+    if expr:
+        params['UpdateExpression'] = " ".join(expr)
+        params['ExpressionAttributeNames'] = names
+        params['ExpressionAttributeValues'] = values
+    return params
+
+def update_record(tableName, key, changes = None, counters = None, condition = None):
+    """
+    Function to update attributes of a record in DynamoDB with one UpdateItem
+    The record is created if it does not exist
+
+    Params:
+        tableName::str
+            The table name to update the record
+        key::dict
+            The primary key of the record
+        changes::dict
+            Attributes to set
+        counters::dict
+            Numeric attributes to increment atomically, by the given amount
+        condition::boto3.dynamodb.conditions.ConditionBase
+            Condition the existing record must satisfy
+
+    Returns:
+        bool
+            If the record was updated or not
+    """
+    if not tableName or not key or not isinstance(key, dict):
+        return False
+
     try:
-        res = ddb.Table(tableName).get_item(
-            Key = {
-                "username": record['username'],
-                "index": record['index']
-            }
-        )
-        record =  { **res['Item'], **record } if 'Item' in res else record
-        ddb.Table(tableName).put_item(
-            Item = record
-        )
+        params = _update_params(key, changes, counters)
+        if condition is not None:
+            params['ConditionExpression'] = condition
+
+        dynamo_table(tableName).update_item(**params)
         return True
 
-    except client.exceptions.ResourceNotFoundException:
+    except _error("ConditionalCheckFailedException"):
+        print("Condition failed @ update_record")
+        return False
+
+    except _error("ResourceNotFoundException"):
         print("Table does not exist")
         return False
 
     except Exception as e:
-        print("Exception @ create_or_update_record\n{}".format(e))
+        print("Exception @ update_record\n{}".format(e))
         return None
 
 def list_tables():
@@ -203,9 +312,9 @@ def list_tables():
             The list of tables
     """
     try:
-        return client.list_tables()['TableNames']
+        return dynamo_client().list_tables()['TableNames']
 
-    except client.exceptions.ResourceNotFoundException:
+    except _error("ResourceNotFoundException"):
         print("Tables do not exist")
         return False
 
@@ -213,13 +322,17 @@ def list_tables():
         print("Exception @ list_tables\n{}".format(e))
         return None
 
-def list_records(tableName):
+def list_records(tableName, attributes = None, segments = 1):
     """
     Function to list all records from a DynamoDB table
 
     Params:
         tableName::str
             The table name to get the records
+        attributes::[str]
+            Only fetch these attributes of each record
+        segments::int
+            Number of parallel scan segments
     Returns:
         records::[dict]
             The list of records stored in the table
@@ -228,15 +341,9 @@ def list_records(tableName):
         return False
 
     try:
-        table = ddb.Table(tableName)
-        res = table.scan()
-        docs = ensure_json(res['Items'])
-        while 'LastEvaluatedKey' in res:
-            res = table.scan(ExclusiveStartKey = res['LastEvaluatedKey'])
-            docs.extend(ensure_json(res['Items']))
-        return docs
-
-    except client.exceptions.ResourceNotFoundException:
+        return list(iter_records(tableName, attributes, segments))
+
+    except _error("ResourceNotFoundException"):
         print("Table does not exist")
         return False
 
@@ -244,6 +351,90 @@ def list_records(tableName):
         print("Exception @ list_records\n{}".format(e))
         return None
 
+def _scan_params(tableName, attributes, pageSize):
+    params = { "TableName": tableName }
+    if attributes:
+        params['ProjectionExpression'] = ", ".join("#p{}".format(i) for i in range(len(attributes)))
+        params['ExpressionAttributeNames'] = { "#p{}".format(i): a for i, a in enumerate(attributes) }
+    if pageSize:
+        params['Limit'] = pageSize
+    return params
+
+def _scan_pages(params):
+    res = dynamo_client().scan(**params)
+    yield res['Items']
+    while 'LastEvaluatedKey' in res:
+        res = dynamo_client().scan(**params, ExclusiveStartKey = res['LastEvaluatedKey'])
+        yield res['Items']
+
+_SEGMENT_DONE = object()
+
+def _offer(pages, item, stop):
+    # Blocks while the queue is full, gives up once the consumer has stopped
+    while not stop.is_set():
+        try:
+            pages.put(item, timeout = 0.5)
+            return True
+        except Full:
+            continue
+    return False
+
+def _scan_segment(params, pages, stop):
+    try:
+        for page in _scan_pages(params):
+            if not _offer(pages, page, stop):
+                return
+        _offer(pages, _SEGMENT_DONE, stop)
+    except Exception as e:
+        _offer(pages, e, stop)
+
+def iter_records(tableName, attributes = None, segments = 1, pageSize = None):
+    """
+    Generator to stream records from a DynamoDB table page by page
+    With segments > 1 the table is scanned in parallel, one worker per segment
+    and records are yielded in no particular order
+
+    Params:
+        tableName::str
+            The table name to get the records
+        attributes::[str]
+            Only fetch these attributes of each record
+        segments::int
+            Number of parallel scan segments
+        pageSize::int
+            Max items evaluated per Scan request
+    Yields:
+        record::dict
+            One record of the table
+    """
+    params = _scan_params(tableName, attributes, pageSize)
+    if segments <= 1:
+        for page in _scan_pages(params):
+            for item in page:
+                yield deserialize_item(item)
+        return
+
+    # Bounded queue keeps at most a couple of pages per segment in memory
+    pages = Queue(maxsize = segments * 2)
+    stop = Event()
+    pool = ThreadPoolExecutor(max_workers = segments)
+    try:
+        for segment in range(segments):
+            pool.submit(_scan_segment, { **params, "Segment": segment, "TotalSegments": segments }, pages, stop)
+        done = 0
+        while done < segments:
+            page = pages.get()
+            if page is _SEGMENT_DONE:
+                done += 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                for item in page:
+                    yield deserialize_item(item)
+    finally:
+        stop.set()
+        pool.shutdown(wait = False)
+
 def get_record(tableName, query):
     """
     Function to retrieve one record from DynamoDB table
@@ -261,13 +452,14 @@ def get_record(tableName, query):
         return False
 
     try:
-        res = ddb.Table(tableName).get_item(
-            Key = query
+        res = dynamo_client().get_item(
+            TableName = tableName,
+            Key = _serialize(query)
         )
-        doc = ensure_json(res['Item']) if 'Item' in res else None
+        doc = deserialize_item(res['Item']) if 'Item' in res else None
         return doc
 
-    except client.exceptions.ResourceNotFoundException:
+    except _error("ResourceNotFoundException"):
         print("Table does not exist")
         return False
 
@@ -275,6 +467,135 @@ def get_record(tableName, query):
         print("Exception @ get_record\n{}".format(e))
         return None
 
+def _unique(items, keyNames = None):
+    # Batch requests reject duplicate keys, the last record for a key wins
+    unique = {}
+    for item in items:
+        names = keyNames or item.keys()
+        unique[tuple((k, repr(item[k])) for k in sorted(names))] = item
+    return list(unique.values())
+
+@lru_cache(maxsize = None)
+def _key_names(tableName):
+    return tuple(k['AttributeName'] for k in dynamo_table(tableName).key_schema)
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def _backoff_delay(attempt):
+    # Full jitter, capped at ~2s
+    return random.uniform(0, min(2.0, 0.05 * (2 ** attempt)))
+
+def _backoff(attempt):
+    time.sleep(_backoff_delay(attempt))
+
+@lru_cache(maxsize = None)
+def _serializer():
+    from boto3.dynamodb.types import TypeSerializer
+    return TypeSerializer()
+
+def _serialize(record):
+    serializer = _serializer()
+    return { k: serializer.serialize(v) for k, v in record.items() }
+
+def _batch_get_chunk(tableName, keys):
+    request = { tableName: { "Keys": [_serialize(k) for k in keys] } }
+    docs = []
+    for attempt in range(BATCH_RETRIES):
+        res = dynamo_client().batch_get_item(RequestItems = request)
+        docs.extend(deserialize_item(item) for item in res['Responses'].get(tableName, []))
+        request = res.get('UnprocessedKeys')
+        if not request:
+            return docs
+        _backoff(attempt)
+    raise Exception("{} keys left unprocessed".format(len(request[tableName]['Keys'])))
+
+def _batch_write_chunk(tableName, records):
+    request = { tableName: [{ "PutRequest": { "Item": _serialize(r) } } for r in records] }
+    for attempt in range(BATCH_RETRIES):
+        res = dynamo_client().batch_write_item(RequestItems = request)
+        request = res.get('UnprocessedItems')
+        if not request:
+            return True
+        _backoff(attempt)
+    raise Exception("{} items left unprocessed".format(len(request[tableName])))
+
+def batch_get_records(tableName, keys, workers = 1):
+    """
+    Function to retrieve many records from a DynamoDB table with BatchGetItem
+    Keys are sent in chunks of 100, unprocessed keys are retried with backoff
+    Duplicate keys are fetched once
+
+    Params:
+        tableName::str
+            The table name to get the records
+        keys::[dict]
+            The primary keys of the records
+        workers::int
+            Number of chunks fetched concurrently
+    Returns:
+        records::[dict]
+            The records found, in no particular order
+    """
+    if not tableName or not keys or not isinstance(keys, list):
+        return False
+
+    try:
+        chunks = _chunks(_unique(keys), BATCH_GET_LIMIT)
+        if workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers = workers) as pool:
+                results = list(pool.map(lambda c: _batch_get_chunk(tableName, c), chunks))
+        else:
+            results = [_batch_get_chunk(tableName, c) for c in chunks]
+        return [doc for docs in results for doc in docs]
+
+    except _error("ResourceNotFoundException"):
+        print("Table does not exist")
+        return False
+
+    except Exception as e:
+        print("Exception @ batch_get_records\n{}".format(e))
+        return None
+
+def batch_write_records(tableName, records, workers = 1):
+    """
+    Function to put many records into a DynamoDB table with BatchWriteItem
+    Records are sent in chunks of 25, unprocessed items are retried with backoff
+    Existing records with the same key are replaced, if the same key appears
+    more than once the last record is written
+
+    Params:
+        tableName::str
+            The table name to store the records
+        records::[dict]
+            The objects to store
+        workers::int
+            Number of chunks written concurrently
+    Returns:
+        bool
+            If all the records were stored or not
+    """
+    if not tableName or not records or not isinstance(records, list):
+        return False
+
+    try:
+        chunks = _chunks(_unique(records, _key_names(tableName)), BATCH_WRITE_LIMIT)
+        if workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers = workers) as pool:
+                list(pool.map(lambda c: _batch_write_chunk(tableName, c), chunks))
+        else:
+            for c in chunks:
+                _batch_write_chunk(tableName, c)
+        return True
+
+    except _error("ResourceNotFoundException"):
+        print("Table does not exist")
+        return False
+
+    except Exception as e:
+        print("Exception @ batch_write_records\n{}".format(e))
+        return None
+
 def delete_table(tableName):
     """
     Function to delete a DynamoDB table
@@ -290,10 +611,10 @@ def delete_table(tableName):
         return False
 
     try:
-        ddb.Table(tableName).delete()
+        dynamo_table(tableName).delete()
         return True
 
-    except client.exceptions.ResourceNotFoundException:
+    except _error("ResourceNotFoundException"):
         print("Table does not exist")
         return False
 
@@ -314,17 +635,16 @@ def delete_record(tableName, query):
         bool
             If the record was deleted or not
     """
-    if not tableName or not key or not val:
+    if not tableName or not query or not isinstance(query, dict):
         return False
 
     try:
-        res = ddb.Table(tableName).delete_item(
+        dynamo_table(tableName).delete_item(
             Key = query
         )
-        print(res)
         return True
 
-    except client.exceptions.ResourceNotFoundException:
+    except _error("ResourceNotFoundException"):
         print("Table does not exist")
         return False
 
@@ -347,11 +667,11 @@ def check_active(tableName):
         return False
 
     try:
-        if ddb.Table(tableName).table_status == "ACTIVE":
+        if dynamo_client().describe_table(TableName = tableName)['Table']['TableStatus'] == "ACTIVE":
             return True
         return False
 
-    except client.exceptions.ResourceNotFoundException:
+    except _error("ResourceNotFoundException"):
         print("Table does not exist")
         return False
 
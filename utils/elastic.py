@@ -7,15 +7,81 @@ All utility functions for interactions with Elasticsearch
 Functions
     - create_or_update_document
     - list_documents
+    - search_page
+    - iter_documents
+    - aggregate
+    - suggest
     - get_document
+    - get_documents
+    - search_documents_by_id
+    - update_document
+    - script_update_document
+    - put_script
     - delete_document
+    - streaming_bulk
+    - bulk_index
+    - put_index_template
+    - put_mapping
+    - create_index
+    - list_indexes
+    - get_alias_indexes
+    - update_aliases
+    - find_document_index
+    - count_documents
+    - delete_index
+    - update_by_query
+    - delete_by_query
+    - task_status
+    - elastic_error
+
+Each function is written once as a generator of (client method, params)
+requests, sent here with the sync client and by utils.aioelastic with the
+async client
 """
-from elasticsearch import Elasticsearch, NotFoundError
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from functools import wraps
+
+from .clients import elastic_client
+
+BULK_CHUNK_SIZE = 500 # Max documents per bulk request
+BULK_CHUNK_BYTES = 10 * 1024 * 1024 # Max bytes per bulk request
+PIT_KEEP_ALIVE = "2m" # How long a point in time stays open between pages
+
+class _NoMatch(Exception):
+    """Never raised, stands in for an exception class that is unavailable"""
+
+def _method(client, name):
+    # "indices.put_mapping" -> client.indices.put_mapping
+    for part in name.split("."):
+        client = getattr(client, part)
+    return client
 
-from constants import ES_URI
-ES = Elasticsearch([ ES_URI ])
+def _run(steps):
+    # Sends each request yielded by steps, client errors are raised inside steps
+    try:
+        request = next(steps)
+        while True:
+            name, params = request
+            try:
+                res = _method(elastic_client(), name)(**params)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(res)
+    except StopIteration as stop:
+        return stop.value
+
+def _requests(steps):
+    # The sync function, keeping steps for utils.aioelastic
+    @wraps(steps)
+    def call(*args, **kwargs):
+        return _run(steps(*args, **kwargs))
+    call.steps = steps
+    return call
 
-def create_or_update_document(index, ID, body):
+@_requests
+def create_or_update_document(index, ID, body, opType = "index"):
     """
     Function to create or update a document in Elasticsearch
 
@@ -26,17 +92,19 @@ def create_or_update_document(index, ID, body):
             ID of the ES document
         body::dict
             Object to be stored as document body
+        opType::str
+            "index" to create or replace, "create" to fail if the ID exists
     Returns:
         True / Exception
     """
     try:
-        global ES
-        ES.index(index = index, id = ID, body = body)
+        yield "index", { "index": index, "id": ID, "body": body, "op_type": opType }
         return True
 
     except Exception as e:
         return e
 
+@_requests
 def list_documents(index, query = {}):
     """
     Function to list all documents from Elasticsearch
@@ -51,12 +119,177 @@ def list_documents(index, query = {}):
             Documents retrieved from ES index
     """
     try:
-        global ES
-        return ES.search(query, index = index, _source = True)['hits']
+        res = yield "search", { "body": query, "index": index, "_source": True, "ignore_unavailable": True }
+        return res['hits']
+
+    except Exception as e:
+        return e
+
+def _encode_cursor(pitID, after):
+    return urlsafe_b64encode(json.dumps({ "pit": pitID, "after": after }).encode()).decode()
+
+def _decode_cursor(cursor):
+    state = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+    return state['pit'], state['after']
+
+def _page_body(query, size, pitID, after):
+    body = {
+        **query,
+        "size": size,
+        "pit": { "id": pitID, "keep_alive": PIT_KEEP_ALIVE },
+        # _shard_doc is the unique tiebreaker of a point in time
+        "sort": list(query.get("sort", [{ "timestamp": "desc" }])) + [{ "_shard_doc": "desc" }],
+        "track_total_hits": after is None
+    }
+    if after is not None:
+        body['search_after'] = after
+    return body
+
+def _open_pit(index):
+    res = yield "open_point_in_time", { "index": index, "keep_alive": PIT_KEEP_ALIVE, "ignore_unavailable": True }
+    return res['id']
+
+def _next_page(query, size, pitID, after):
+    # One page of iter_documents, with the point in time to read the next one
+    res = yield "search", { "body": { **_page_body(query, size, pitID, after), "track_total_hits": False } }
+    return res['hits']['hits'], res.get('pit_id', pitID)
+
+def _close_pit(pitID):
+    try:
+        yield "close_point_in_time", { "body": { "id": pitID } }
+    except Exception as e:
+        print("Exception @ _close_pit\n{}".format(e))
+
+@_requests
+def search_page(index, query = {}, size = 50, cursor = None):
+    """
+    Function to get one page of documents, sorted by timestamp by default
+    Pages are read from a point in time, so they stay consistent while
+    documents are written
+
+    Params:
+        index::str
+            ES index to search for documents
+        query::dict
+            Query object to search
+        size::int
+            Documents per page
+        cursor::str
+            Cursor returned with the previous page, None for the first page
+    Returns:
+        total::int
+            Total matching documents, only on the first page
+        hits::[dict]
+            Documents of this page
+        cursor::str
+            Cursor of the next page, None on the last page
+    """
+    try:
+        if cursor:
+            pitID, after = _decode_cursor(cursor)
+        else:
+            pitID = yield from _open_pit(index)
+            after = None
+        res = yield "search", { "body": _page_body(query, size, pitID, after) }
+        hits = res['hits']['hits']
+        pitID = res.get('pit_id', pitID)
+        if len(hits) < size:
+            yield from _close_pit(pitID)
+            nextCursor = None
+        else:
+            nextCursor = _encode_cursor(pitID, hits[-1]['sort'])
+        total = res['hits']['total']['value'] if after is None else None
+        return { "total": total, "hits": hits, "cursor": nextCursor }
+
+    except Exception as e:
+        return e
+
+def iter_documents(index, query = {}, size = 500):
+    """
+    Generator to stream every matching document of an index page by page
+
+    Params:
+        index::str
+            ES index to search for documents
+        query::dict
+            Query object to search
+        size::int
+            Documents per request
+    Yields:
+        hit::dict
+            One document retrieved from ES index
+    """
+    pitID = _run(_open_pit(index))
+    after = None
+    try:
+        while True:
+            hits, pitID = _run(_next_page(query, size, pitID, after))
+            for hit in hits:
+                yield hit
+            if len(hits) < size:
+                return
+            after = hits[-1]['sort']
+    finally:
+        _run(_close_pit(pitID))
+
+@_requests
+def aggregate(index, query, aggs, runtime = None):
+    """
+    Function to run aggregations without fetching any documents
+    Fails if any shard fails, instead of returning partial results
+
+    Params:
+        index::str
+            ES index to aggregate
+        query::dict
+            Query selecting the documents
+        aggs::dict
+            The aggregations to run
+        runtime::dict
+            Runtime mappings of the search
+    Returns:
+        total::int
+            Number of matching documents
+        aggregations::dict
+            The aggregation results
+    """
+    try:
+        body = { "query": query, "aggs": aggs, "size": 0, "track_total_hits": True }
+        if runtime:
+            body['runtime_mappings'] = runtime
+        res = yield "search", { "body": body, "index": index, "ignore_unavailable": True }
+        if res['_shards']['failed'] > 0:
+            reasons = [f.get('reason', {}).get('reason') for f in res['_shards'].get('failures', [])]
+            raise Exception("{} of {} shards failed: {}".format(res['_shards']['failed'], res['_shards']['total'], reasons))
+        return { "total": res['hits']['total']['value'], "aggregations": res.get('aggregations', {}) }
 
     except Exception as e:
         return e
 
+@_requests
+def suggest(index, suggestions, source = False):
+    """
+    Function to run suggesters, eg. completion suggesters
+
+    Params:
+        index::str
+            ES index to search
+        suggestions::dict
+            The suggesters to run, by name
+        source::bool|[str]
+            Fields of the suggested documents to return
+    Returns:
+        suggest::dict / Exception
+            The suggester results, by name
+    """
+    try:
+        res = yield "search", { "body": { "suggest": suggestions, "_source": source }, "index": index }
+        return res['suggest']
+
+    except Exception as e:
+        return e
+
+@_requests
 def get_document(index, ID):
     """
     Function to get one document from Elasticsearch
@@ -71,12 +304,154 @@ def get_document(index, ID):
             Document retrieved from ES index
     """
     try:
-        global ES
-        return ES.get(index = index, id = ID)
+        return (yield "get", { "index": index, "id": ID })
+
+    except Exception as e:
+        return e
+
+@_requests
+def get_documents(index, IDs, source = None):
+    """
+    Function to get many documents from Elasticsearch with one _mget
+
+    Params:
+        index::str
+            ES index to get the documents
+        IDs::[str]
+            IDs of the documents
+        source::[str]
+            Only return these fields of each document
+    Returns:
+        docs::[dict] / Exception
+            One entry per ID, with "found" False for missing documents
+    """
+    try:
+        params = { "_source": source } if source else {}
+        res = yield "mget", { "body": { "ids": IDs }, "index": index, **params }
+        return res['docs']
+
+    except Exception as e:
+        return e
+
+@_requests
+def search_documents_by_id(index, IDs, source = None):
+    """
+    Function to find documents by id across the indexes behind an alias
+
+    Params:
+        index::str
+            ES index or alias to search
+        IDs::[str]
+            IDs of the documents
+        source::[str]
+            Only return these fields of each document
+    Returns:
+        hits::[dict] / Exception
+            The documents found
+    """
+    try:
+        body = { "query": { "ids": { "values": IDs } }, "size": len(IDs) }
+        if source:
+            body['_source'] = source
+        res = yield "search", { "body": body, "index": index, "ignore_unavailable": True }
+        return res['hits']['hits']
+
+    except Exception as e:
+        return e
+
+@_requests
+def update_document(index, ID, changes, retries = 3, seqNo = None, primaryTerm = None, source = None):
+    """
+    Function to partially update one document with the _update API
+    Changes are merged into the stored document by Elasticsearch
+    If seqNo and primaryTerm are passed, the update only applies if the
+    document has not changed since it was read
+
+    Params:
+        index::str
+            ES index of the document
+        ID::str
+            ID of the document to update
+        changes::dict
+            Fields to merge into the document
+        retries::int
+            Retries on version conflicts, ignored with seqNo / primaryTerm
+        seqNo::int
+            _seq_no of the document when it was read
+        primaryTerm::int
+            _primary_term of the document when it was read
+        source::str|[str]
+            Fields of the updated document to return
+    Returns:
+        res::dict / Exception
+            The update response
+    """
+    try:
+        params = {}
+        if seqNo is not None and primaryTerm is not None:
+            params['if_seq_no'] = seqNo
+            params['if_primary_term'] = primaryTerm
+        else:
+            params['retry_on_conflict'] = retries
+        if source:
+            params['_source'] = source
+        return (yield "update", { "index": index, "id": ID, "body": { "doc": changes }, **params })
+
+    except Exception as e:
+        return e
+
+@_requests
+def script_update_document(index, ID, scriptID, params, retries = 3):
+    """
+    Function to update one document by running a stored script on it
+
+    Params:
+        index::str
+            ES index of the document
+        ID::str
+            ID of the document to update
+        scriptID::str
+            ID of the stored script
+        params::dict
+            Params passed to the script
+        retries::int
+            Retries on version conflicts
+    Returns:
+        res::dict / Exception
+            The update response
+    """
+    try:
+        return (yield "update", {
+            "index": index,
+            "id": ID,
+            "body": { "script": { "id": scriptID, "params": params } },
+            "retry_on_conflict": retries
+        })
+
+    except Exception as e:
+        return e
+
+@_requests
+def put_script(scriptID, source):
+    """
+    Function to create or replace a stored painless script
+
+    Params:
+        scriptID::str
+            ID of the stored script
+        source::str
+            Painless source of the script
+    Returns:
+        True / Exception
+    """
+    try:
+        yield "put_script", { "id": scriptID, "body": { "script": { "lang": "painless", "source": source } } }
+        return True
 
     except Exception as e:
         return e
 
+@_requests
 def delete_document(index, ID):
     """
     Function to delete one document on Elasticsearch
@@ -90,9 +465,392 @@ def delete_document(index, ID):
         True / Exception
     """
     try:
-        global ES
-        ES.delete(index = index, id = ID)
+        yield "delete", { "index": index, "id": ID }
+        return True
+
+    except Exception as e:
+        return e
+
+def _set_refresh(indexes, interval):
+    yield "indices.put_settings", { "index": ",".join(indexes), "body": { "index": { "refresh_interval": interval } } }
+
+def _resume_refresh(indexes):
+    # Back to the index default
+    yield from _set_refresh(indexes, None)
+    yield "indices.refresh", { "index": ",".join(indexes) }
+
+def _bulk_action(opType, index, ID, body):
+    return { "_op_type": opType, "_index": index, "_id": ID, "_source": body }
+
+def _bulk_params(chunkSize, maxChunkBytes):
+    return { "chunk_size": chunkSize, "max_chunk_bytes": maxChunkBytes, "raise_on_error": False, "raise_on_exception": False }
+
+def _count_bulk(counts, ok, item):
+    # Adds one streaming_bulk result to the bulk_index result
+    if ok:
+        counts['indexed'] += 1
+    else:
+        counts['errors'].append(item)
+
+def streaming_bulk(docs, chunkSize = BULK_CHUNK_SIZE, maxChunkBytes = BULK_CHUNK_BYTES, threads = 1, opType = "index"):
+    """
+    Generator to index documents with the bulk API
+    Requests are split by document count and byte size
+
+    Params:
+        docs::iterable((str, str, dict))
+            (index, ID, body) of each document
+        chunkSize::int
+            Max documents per request
+        maxChunkBytes::int
+            Max bytes per request
+        threads::int
+            Number of requests sent in parallel
+        opType::str
+            "index" to create or replace, "create" to fail if the ID exists
+    Yields:
+        ok::bool
+            If the document was indexed or not
+        item::dict
+            The bulk response item of the document
+    """
+    from elasticsearch import helpers
+
+    actions = (_bulk_action(opType, index, ID, body) for index, ID, body in docs)
+    if threads > 1:
+        return helpers.parallel_bulk(elastic_client(), actions, thread_count = threads, **_bulk_params(chunkSize, maxChunkBytes))
+    return helpers.streaming_bulk(elastic_client(), actions, max_retries = 3, **_bulk_params(chunkSize, maxChunkBytes))
+
+def bulk_index(docs, chunkSize = BULK_CHUNK_SIZE, maxChunkBytes = BULK_CHUNK_BYTES, threads = 1, pauseRefresh = None, opType = "index"):
+    """
+    Function to index many documents with the bulk API
+
+    Params:
+        docs::iterable((str, str, dict))
+            (index, ID, body) of each document
+        chunkSize::int
+            Max documents per request
+        maxChunkBytes::int
+            Max bytes per request
+        threads::int
+            Number of requests sent in parallel
+        pauseRefresh::[str]
+            Indexes to stop refreshing during the load, refreshed once at the end
+        opType::str
+            "index" to create or replace, "create" to fail if the ID exists
+    Returns:
+        indexed::int
+            Number of documents indexed
+        errors::[dict]
+            The bulk response items of the failed documents
+    """
+    try:
+        if pauseRefresh:
+            _run(_set_refresh(pauseRefresh, "-1"))
+        try:
+            counts = { "indexed": 0, "errors": [] }
+            for ok, item in streaming_bulk(docs, chunkSize, maxChunkBytes, threads, opType):
+                _count_bulk(counts, ok, item)
+        finally:
+            if pauseRefresh:
+                _run(_resume_refresh(pauseRefresh))
+        return counts
+
+    except Exception as e:
+        return e
+
+@_requests
+def put_index_template(name, body):
+    """
+    Function to create or replace a composable index template
+
+    Params:
+        name::str
+            Name of the template
+        body::dict
+            The template, with index_patterns, settings and mappings
+    Returns:
+        True / Exception
+    """
+    try:
+        yield "indices.put_index_template", { "name": name, "body": body }
+        return True
+
+    except Exception as e:
+        return e
+
+@_requests
+def put_mapping(index, properties):
+    """
+    Function to add fields to the mapping of an existing index
+
+    Params:
+        index::str
+            Name of the index
+        properties::dict
+            The field mappings to add
+    Returns:
+        True / Exception
+    """
+    try:
+        yield "indices.put_mapping", { "index": index, "body": { "properties": properties } }
+        return True
+
+    except Exception as e:
+        return e
+
+@_requests
+def create_index(index, body = None):
+    """
+    Function to create an index, if it does not exist yet
+
+    Params:
+        index::str
+            Name of the index
+        body::dict
+            Settings and mappings of the index
+    Returns:
+        True / Exception
+    """
+    try:
+        yield "indices.create", { "index": index, "body": body, "ignore": [400] }
+        return True
+
+    except Exception as e:
+        return e
+
+@_requests
+def list_indexes(pattern):
+    """
+    Function to get the names of the indexes matching a pattern
+
+    Params:
+        pattern::str
+            Index name or wildcard pattern, eg. "user-spottings-*"
+    Returns:
+        indexes::[str] / Exception
+            The matching indexes
+    """
+    try:
+        res = yield "cat.indices", { "index": pattern, "h": "index", "format": "json" }
+        return [row['index'] for row in res]
+
+    except Exception as e:
+        return e
+
+@_requests
+def get_alias_indexes(alias):
+    """
+    Function to get the indexes an alias points to
+
+    Params:
+        alias::str
+            Name of the alias
+    Returns:
+        indexes::[str] / Exception
+            The indexes of the alias
+    """
+    try:
+        res = yield "indices.get_alias", { "name": alias, "ignore": [404] }
+        return [index for index in res if index not in { "error", "status" }]
+
+    except Exception as e:
+        return e
+
+@_requests
+def update_aliases(actions):
+    """
+    Function to apply alias actions atomically
+
+    Params:
+        actions::[dict]
+            The add / remove actions
+    Returns:
+        True / Exception
+    """
+    try:
+        yield "indices.update_aliases", { "body": { "actions": actions } }
+        return True
+
+    except Exception as e:
+        return e
+
+@_requests
+def find_document_index(index, ID):
+    """
+    Function to find which index holds a document, eg. behind an alias
+
+    Params:
+        index::str
+            ES index or alias to search
+        ID::str
+            ID of the document
+    Returns:
+        index::str / Exception
+            The concrete index of the document, None if not found
+    """
+    try:
+        res = yield "search", {
+            "body": { "query": { "ids": { "values": [ID] } }, "size": 1, "_source": False },
+            "index": index,
+            "ignore_unavailable": True
+        }
+        hits = res['hits']['hits']
+        return hits[0]['_index'] if hits else None
+
+    except Exception as e:
+        return e
+
+@_requests
+def count_documents(index, query = None):
+    """
+    Function to count the documents of an index
+
+    Params:
+        index::str
+            ES index to count
+        query::dict
+            Only count documents matching this query
+    Returns:
+        count::int / Exception
+            Number of documents
+    """
+    try:
+        body = { "query": query } if query else None
+        res = yield "count", { "body": body, "index": index }
+        return res['count']
+
+    except Exception as e:
+        return e
+
+@_requests
+def delete_index(index):
+    """
+    Function to delete an index
+
+    Params:
+        index::str
+            ES index to delete
+    Returns:
+        True / Exception
+    """
+    try:
+        yield "indices.delete", { "index": index }
         return True
 
     except Exception as e:
-        return e
\ No newline at end of file
+        return e
+
+def _task_params(requestsPerSecond):
+    # Background, sliced and throttled, version conflicts are skipped
+    return {
+        "conflicts": "proceed",
+        "slices": "auto",
+        "wait_for_completion": False,
+        "requests_per_second": requestsPerSecond or -1,
+        "ignore_unavailable": True
+    }
+
+@_requests
+def update_by_query(index, query, script, params = None, requestsPerSecond = None):
+    """
+    Function to start a background task updating every matching document
+
+    Params:
+        index::str
+            ES index or alias to update
+        query::dict
+            Query selecting the documents
+        script::str
+            Painless source applied to each document, None to reindex the
+            documents in place, eg. after a mapping change
+        params::dict
+            Params passed to the script
+        requestsPerSecond::int
+            Throttle, in documents per second
+    Returns:
+        taskID::str / Exception
+            The task running the update, see task_status
+    """
+    try:
+        body = { "query": query }
+        if script is not None:
+            body['script'] = { "lang": "painless", "source": script, "params": params or {} }
+        res = yield "update_by_query", { "index": index, "body": body, **_task_params(requestsPerSecond) }
+        return res['task']
+
+    except Exception as e:
+        return e
+
+@_requests
+def delete_by_query(index, query, requestsPerSecond = None):
+    """
+    Function to start a background task deleting every matching document
+
+    Params:
+        index::str
+            ES index or alias to delete from
+        query::dict
+            Query selecting the documents
+        requestsPerSecond::int
+            Throttle, in documents per second
+    Returns:
+        taskID::str / Exception
+            The task running the deletion, see task_status
+    """
+    try:
+        res = yield "delete_by_query", { "index": index, "body": { "query": query }, **_task_params(requestsPerSecond) }
+        return res['task']
+
+    except Exception as e:
+        return e
+
+@_requests
+def task_status(taskID):
+    """
+    Function to get the progress of a background task
+
+    Params:
+        taskID::str
+            The task ID returned when it was started
+    Returns:
+        completed::bool
+            If the task has finished
+        total::int
+            Documents matched by the task
+        done::int
+            Documents updated / deleted so far
+        failures::[dict]
+            Failures, once the task has finished
+    """
+    try:
+        res = yield "tasks.get", { "task_id": taskID }
+        status = res['task']['status']
+        return {
+            "completed": res['completed'],
+            "total": status['total'],
+            "done": status['updated'] + status['created'] + status['deleted'] + status['noops'],
+            "failures": res.get('response', {}).get('failures', [])
+        }
+
+    except Exception as e:
+        return e
+
+def elastic_error(name):
+    """
+    Function to get an Elasticsearch exception class for an except clause,
+    without importing elasticsearch when the module is loaded
+
+    Params:
+        name::str
+            The exception name, eg. "NotFoundError"
+    Returns:
+        cls::type
+            The exception class, one that never matches if elasticsearch
+            is not installed
+    """
+    try:
+        from elasticsearch import exceptions
+        return getattr(exceptions, name)
+    except ImportError:
+        return _NoMatch
@@ -0,0 +1,89 @@
+"""
+ID Utils
+========
+
+Allocation of sequential document ids from Redis counters
+Each process reserves a block of ids with one INCRBY and hands them out
+locally, so most allocations never leave the process
+
+Functions
+    - reserve_ids
+    - next_id
+"""
+from threading import Lock
+
+from .redis import increment, key_exists, set_if_missing
+
+ID_BLOCK = 20 # Ids reserved per round trip
+
+_blocks = {} # counter -> [next, last]
+_lock = Lock()
+
+def _ensure_counter(counter, seed):
+    if seed is None or key_exists(counter):
+        return
+    # Only the first process to get here sets the start value
+    start = seed()
+    if start is None:
+        raise Exception("Could not seed counter {}".format(counter))
+    set_if_missing(counter, int(start))
+
+def reserve_ids(counter, count, seed = None):
+    """
+    Function to reserve a contiguous range of ids, eg. for bulk imports
+
+    Params:
+        counter::str
+            The Redis counter key
+        count::int
+            Number of ids to reserve
+        seed::function
+            Returns the last id already in use, called if the counter is missing
+    Returns:
+        ids::range
+            The reserved ids
+    """
+    if not counter or count < 1:
+        return False
+
+    try:
+        _ensure_counter(counter, seed)
+        last = increment(counter, count)
+        if last is None:
+            return None
+        return range(last - count + 1, last + 1)
+
+    except Exception as e:
+        print("Exception @ reserve_ids\n{}".format(e))
+        return None
+
+def next_id(counter, seed = None, block = ID_BLOCK):
+    """
+    Function to get the next id from a counter
+    Ids come from a block reserved by this process, so they are unique but
+    not strictly ordered across processes
+
+    Params:
+        counter::str
+            The Redis counter key
+        seed::function
+            Returns the last id already in use, called if the counter is missing
+        block::int
+            Number of ids to reserve when the local block runs out
+    Returns:
+        id::int
+            The allocated id
+    """
+    if not counter:
+        return False
+
+    with _lock:
+        current = _blocks.get(counter)
+        if current is None or current[0] > current[1]:
+            ids = reserve_ids(counter, block, seed)
+            if not ids:
+                return None
+            current = _blocks[counter] = [ids[0], ids[-1]]
+        nextId = current[0]
+        current[0] += 1
+        return nextId
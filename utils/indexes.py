@@ -0,0 +1,266 @@
+"""
+Index Utils
+===========
+
+Naming and routing for the yearly Elasticsearch indexes
+Documents of an entity ("journeys", "spottings") live in "user-<entity>-<year>"
+The read alias "user-<entity>" spans every year and the write alias
+"user-<entity>-write" points at the current year
+Writes always go to the current year, whatever the document timestamp, so
+reads go through the read alias and filter by timestamp in the query
+Indexes created before the templates map strings as text (with a .keyword
+subfield) and timestamps as long, queries that must work on both use
+keyword_term and runtime_fields
+
+Functions
+    - yearly_index
+    - read_alias
+    - write_alias
+    - roll_write_alias
+    - alias_existing_indexes
+    - write_target
+    - route_by_id
+    - get_many_by_id
+    - keyword_term
+    - runtime_fields
+
+Usage
+    python -m utils.indexes alias <journeys|spottings>
+"""
+import re
+import time
+import argparse
+from threading import Lock
+
+from .elastic import elastic_error, create_index, list_indexes, get_alias_indexes, update_aliases, find_document_index, get_documents, search_documents_by_id
+
+_rolled = {} # entity -> year the write alias was last checked for
+_lock = Lock()
+
+def yearly_index(entity, year = None):
+    """
+    Function to get the name of a yearly index
+
+    Params:
+        entity::str
+            "journeys" or "spottings"
+        year::int
+            The year, defaults to the current year
+    Returns:
+        index::str
+            The index name
+    """
+    return "user-{}-{}".format(entity, year or time.strftime("%Y"))
+
+def read_alias(entity):
+    """
+    Function to get the alias spanning every yearly index of an entity
+
+    Params:
+        entity::str
+    Returns:
+        alias::str
+    """
+    return "user-" + entity
+
+def write_alias(entity):
+    """
+    Function to get the alias of the index new documents go to
+
+    Params:
+        entity::str
+    Returns:
+        alias::str
+    """
+    return "user-{}-write".format(entity)
+
+def roll_write_alias(entity, year = None):
+    """
+    Function to point the write alias at a yearly index, creating it if needed
+    The index is also added to the read alias
+
+    Params:
+        entity::str
+        year::int
+            The year, defaults to the current year
+    Returns:
+        bool
+            If the alias points at the index or not
+    """
+    try:
+        index = yearly_index(entity, year)
+        res = create_index(index)
+        if isinstance(res, Exception):
+            raise res
+        current = get_alias_indexes(write_alias(entity))
+        if isinstance(current, Exception):
+            raise current
+        readers = get_alias_indexes(read_alias(entity))
+        if isinstance(readers, Exception):
+            raise readers
+        if current == [index] and index in readers:
+            return True
+        actions = [{ "remove": { "index": i, "alias": write_alias(entity) } } for i in current if i != index]
+        actions.append({ "add": { "index": index, "alias": write_alias(entity), "is_write_index": True } })
+        actions.append({ "add": { "index": index, "alias": read_alias(entity) } })
+        res = update_aliases(actions)
+        if isinstance(res, Exception):
+            raise res
+        return True
+
+    except Exception as e:
+        print("Exception @ roll_write_alias\n{}".format(e))
+        return None
+
+def alias_existing_indexes(entity):
+    """
+    Function to add every yearly index of an entity to its read alias
+    One-off for indexes created before the read alias existed
+
+    Params:
+        entity::str
+    Returns:
+        indexes::[str]
+            The yearly indexes in the read alias
+    """
+    try:
+        indexes = list_indexes("user-{}-*".format(entity))
+        if isinstance(indexes, Exception):
+            raise indexes
+        yearly = [i for i in indexes if re.fullmatch(r"user-{}-\d{{4}}".format(re.escape(entity)), i)]
+        if yearly:
+            res = update_aliases([{ "add": { "index": i, "alias": read_alias(entity) } } for i in yearly])
+            if isinstance(res, Exception):
+                raise res
+        return sorted(yearly)
+
+    except Exception as e:
+        print("Exception @ alias_existing_indexes\n{}".format(e))
+        return None
+
+def write_target(entity):
+    """
+    Function to get the index to write new documents to
+    The write alias is moved to the new year's index by the first write
+    of each process after New Year
+
+    Params:
+        entity::str
+    Returns:
+        alias::str
+            The write alias
+    """
+    year = int(time.strftime("%Y"))
+    if _rolled.get(entity) != year:
+        with _lock:
+            if _rolled.get(entity) != year:
+                if not roll_write_alias(entity, year):
+                    raise Exception("Could not roll write alias of {}".format(entity))
+                _rolled[entity] = year
+    return write_alias(entity)
+
+def route_by_id(entity, ID, op):
+    """
+    Function to run a document operation on the index holding the document
+    The current year is tried first, older years are found with a search
+
+    Params:
+        entity::str
+        ID::str
+            ID of the document
+        op::function
+            Takes the index name, returns the result of an utils.elastic call
+    Returns:
+        res::dict / Exception
+            The result of op
+    """
+    res = op(write_target(entity))
+    if isinstance(res, elastic_error("NotFoundError")):
+        index = find_document_index(read_alias(entity), ID)
+        if isinstance(index, Exception):
+            return index
+        if index:
+            res = op(index)
+    return res
+
+def get_many_by_id(entity, IDs, source = None):
+    """
+    Function to get many documents by id in as few requests as possible
+    One _mget on the current year, one search for ids from older years
+
+    Params:
+        entity::str
+        IDs::[str]
+            IDs of the documents
+        source::[str]
+            Only return these fields of each document
+    Returns:
+        docs::dict / Exception
+            The documents found, by ID
+    """
+    unique = list(dict.fromkeys(IDs))
+    res = get_documents(write_target(entity), unique, source)
+    if isinstance(res, Exception):
+        return res
+    docs = { doc['_id']: doc for doc in res if doc.get('found') }
+    missing = [ID for ID in unique if ID not in docs]
+    if missing:
+        hits = search_documents_by_id(read_alias(entity), missing, source)
+        if isinstance(hits, Exception):
+            return hits
+        docs.update({ hit['_id']: hit for hit in hits })
+    return docs
+
+
+# Runtime field scripts, values are read from _source so mappings do not matter
+KEYWORD_SCRIPT = "def v = params._source[params.field]; if (v != null) { emit(v.toString()); }"
+EPOCH_SCRIPT = "def v = params._source[params.field]; if (v instanceof Number) { emit(((Number) v).longValue() * 1000L); }"
+
+def keyword_term(field, value):
+    """
+    Function to get an exact match filter on a string field
+    Matches the field where it is a keyword and its .keyword subfield where
+    it is text, an unmapped field matches nothing
+
+    Params:
+        field::str
+        value::str
+    Returns:
+        query::dict
+    """
+    return { "bool": {
+        "should": [{ "term": { field: value } }, { "term": { field + ".keyword": value } }],
+        "minimum_should_match": 1
+    } }
+
+def runtime_fields(keywords = None, epochs = None):
+    """
+    Function to get search time runtime mappings which shadow mapped fields,
+    so they can be aggregated on every index whatever their mapping
+    Values are read from _source, only use them on small document sets or
+    offline jobs
+
+    Params:
+        keywords::[str]
+            String fields, as keyword
+        epochs::[str]
+            Unix timestamp fields, as date
+    Returns:
+        runtime::dict
+            The runtime_mappings of the search
+    """
+    runtime = {}
+    for field in keywords or []:
+        runtime[field] = { "type": "keyword", "script": { "source": KEYWORD_SCRIPT, "params": { "field": field } } }
+    for field in epochs or []:
+        runtime[field] = { "type": "date", "script": { "source": EPOCH_SCRIPT, "params": { "field": field } } }
+    return runtime
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Manage the yearly Elasticsearch indexes")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    aliasCmd = commands.add_parser("alias")
+    aliasCmd.add_argument("entity", choices = ["journeys", "spottings"])
+    args = parser.parse_args()
+
+    print(alias_existing_indexes(args.entity))
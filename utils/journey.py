@@ -3,24 +3,116 @@ Journey Utils
 =============
 
 All utility functions to manage journey documents in Elasticsearch
-The index user is "user-journeys-<current year>"
+Documents are written to "user-journeys-<current year>" through the
+write alias and read from every year through the read alias
 
 Functions
+    - create_journey_template
     - create_journey
+    - create_journeys
     - list_journeys
+    - iter_journeys
     - most_recent_journey
+    - active_journey_key
+    - active_journey
     - get_journey
+    - get_journeys
     - update_journey
     - add_halt_to_journey
+    - add_halts_to_journey
     - deactivate_journey
+    - deactivate_stale_journeys
     - delete_journey
 """
 import time
-from elasticsearch import NotFoundError
+from base64 import urlsafe_b64encode
+
+from .redis import set_data, get_data, get_many, delete_key
+from .indexes import write_target, read_alias, route_by_id, get_many_by_id, keyword_term
+from .elastic import elastic_error, update_by_query, bulk_index, create_or_update_document, list_documents, search_page, iter_documents, get_document, update_document, put_index_template, script_update_document, put_script, delete_document
+
+ENTITY = "journeys"
+ACTIVE_TTL = 86400 # Same as the default age of deactivate_stale_journeys
+NO_ACTIVE_TTL = 60 # How long "no active journey" is remembered
+ACTIVE_CUTOFF_KEY = "ActiveJourneyCutoff" # Journeys older than this were deactivated in bulk
+
+TEMPLATE = {
+    "index_patterns": ["user-journeys-*"],
+    "template": {
+        "aliases": { "user-journeys": {} },
+        "settings": {
+            "number_of_shards": 1,
+            "number_of_replicas": 1,
+            "refresh_interval": "5s",
+            # Documents are stored newest first, so "most recent" queries stop early
+            "sort.field": "timestamp",
+            "sort.order": "desc"
+        },
+        "mappings": {
+            # Unknown fields are kept in _source but not indexed
+            "dynamic": False,
+            "properties": {
+                "username": { "type": "keyword" },
+                "train_number": { "type": "keyword" },
+                "train_name": { "type": "text", "fields": { "raw": { "type": "keyword" } } },
+                "from": { "type": "keyword" },
+                "to": { "type": "keyword" },
+                "loco_number": { "type": "keyword" },
+                "loco_class": { "type": "keyword" },
+                "loco_shed": { "type": "keyword" },
+                # Halts are only read back from _source
+                "halts": { "type": "object", "enabled": False },
+                "is_active": { "type": "boolean" },
+                "timestamp": { "type": "date", "format": "epoch_second" },
+                "updated_timestamp": { "type": "date", "format": "epoch_second" }
+            }
+        }
+    }
+}
+
+# Appends halts which are not in the journey yet, matched by station & timestamp
+ADD_HALTS_SCRIPT = "journey-add-halts"
+ADD_HALTS_SOURCE = """
+if (ctx._source.halts == null) { ctx._source.halts = []; }
+Set seen = new HashSet();
+for (def h : ctx._source.halts) { seen.add(h.station + '|' + h.timestamp); }
+boolean changed = false;
+for (def h : params.halts) {
+    if (seen.add(h.station + '|' + h.timestamp)) {
+        ctx._source.halts.add(h);
+        changed = true;
+    }
+}
+if (!changed) { ctx.op = 'noop'; }
+"""
+_scriptReady = False
+
+def _ensure_halts_script():
+    global _scriptReady
+    if not _scriptReady:
+        res = put_script(ADD_HALTS_SCRIPT, ADD_HALTS_SOURCE)
+        if isinstance(res, Exception):
+            raise res
+        _scriptReady = True
 
-from .elastic import create_or_update_document, list_documents, get_document, delete_document
+def create_journey_template():
+    """
+    Function to create the index template of the yearly journey indexes
+    Only applies to indexes created after it, existing ones must be reindexed
+
+    Returns:
+        bool
+            If the template was created or not
+    """
+    try:
+        res = put_index_template("user-journeys", TEMPLATE)
+        if isinstance(res, Exception):
+            raise res
+        return True
 
-INDEX = "user-journeys-" + time.strftime("%Y")
+    except Exception as e:
+        print("Exception @ create_journey_template\n{}".format(e))
+        return None
 
 def create_journey(ID, body):
     """
@@ -44,35 +136,98 @@ def create_journey(ID, body):
             body['timestamp'] = int(time.time())
         if 'is_active' not in body:
             body['is_active'] = True
-        global INDEX
-        create_or_update_document(INDEX, ID, body)
+        res = create_or_update_document(write_target(ENTITY), ID, body)
+        if isinstance(res, Exception):
+            raise res
+        if body['is_active']:
+            _set_active(body['username'], ID, body['timestamp'])
         return True
 
     except Exception as e:
-        print("Exception @ create_spotting\n{}".format(e))
+        print("Exception @ create_journey\n{}".format(e))
+        return None
+
+def create_journeys(docs, threads = 1):
+    """
+    Function to create many journey documents in Elasticsearch with the bulk API
+
+    Params:
+        docs::[(str, dict)]
+            (ID, body) of each journey document
+        threads::int
+            Number of bulk requests sent in parallel
+    Returns:
+        created::int
+            Number of documents created
+        errors::[dict]
+            The documents which could not be created
+    """
+    if not docs:
+        return False
+
+    try:
+        now = int(time.time())
+        invalid = []
+        index = write_target(ENTITY)
+        def actions():
+            for ID, body in docs:
+                # Required fields check
+                if not ID or not body or not {"username", "train_number", "from"}.issubset(body):
+                    invalid.append({ "_id": ID, "error": "Missing required fields" })
+                    continue
+                yield index, ID, { "timestamp": now, "is_active": True, **body }
+        res = bulk_index(actions(), threads = threads)
+        if isinstance(res, Exception):
+            raise res
+        return { "created": res['indexed'], "errors": invalid + res['errors'] }
+
+    except Exception as e:
+        print("Exception @ create_journeys\n{}".format(e))
         return None
 
-def list_journeys(includeInactive = False):
+def _filter_query(includeInactive = False, since = None, until = None):
+    filters = [] if includeInactive else [{ "term": { "is_active": True } }]
+    if since is not None or until is not None:
+        bounds = { "format": "epoch_second" }
+        if since is not None:
+            bounds['gte'] = since
+        if until is not None:
+            bounds['lte'] = until
+        filters.append({ "range": { "timestamp": bounds } })
+    return { "query": { "bool": { "filter": filters } } } if filters else {}
+
+def list_journeys(includeInactive = False, size = 50, cursor = None, since = None, until = None):
     """
-    Function to list all the journey documents in Elasticsearch
+    Function to list the journey documents in Elasticsearch, one page at a time
 
     Params:
         includeInactive::bool
             If inactive records must be included in the result or not
+        size::int
+            Documents per page
+        cursor::str
+            Cursor returned with the previous page
+        since::int
+            Only documents from this unix timestamp on
+        until::int
+            Only documents up to this unix timestamp
     Returns:
         total_docs::int
-            The total number of records
+            The total number of records, only on the first page
         docs::[dict]
             The list of documents
+        cursor::str
+            Cursor of the next page, None on the last page
     """
     try:
-        query = {} if includeInactive else { "query": { "term": { "is_active": True } } }
-        global INDEX
-        search = list_documents(INDEX, query)
-        docs = [{ "_id": hit['_id'], **hit['_source'] } for hit in search['hits']]
-        return { "total_docs": len(docs), "docs": docs }
-
-    except NotFoundError:
+        query = _filter_query(includeInactive, since, until)
+        page = search_page(read_alias(ENTITY), query, size, cursor)
+        if isinstance(page, Exception):
+            raise page
+        docs = [{ "_id": hit['_id'], **hit['_source'] } for hit in page['hits']]
+        return { "total_docs": page['total'], "docs": docs, "cursor": page['cursor'] }
+
+    except elastic_error("NotFoundError"):
         print("No documents found at list_journeys")
         return False
 
@@ -80,6 +235,21 @@ def list_journeys(includeInactive = False):
         print("Exception @ list_journeys\n{}".format(e))
         return None
 
+def iter_journeys(includeInactive = False):
+    """
+    Generator to stream every journey document in Elasticsearch
+
+    Params:
+        includeInactive::bool
+            If inactive records must be included in the result or not
+    Yields:
+        doc::dict
+            One journey document
+    """
+    query = _filter_query(includeInactive)
+    for hit in iter_documents(read_alias(ENTITY), query):
+        yield { "_id": hit['_id'], **hit['_source'] }
+
 def most_recent_journey(username = None):
     """
     Function to retrieve most recent journey document from Elasticsearch
@@ -96,18 +266,26 @@ def most_recent_journey(username = None):
             "sort": [
                 { "timestamp": "desc" }
             ],
-            "size": 1
+            "size": 1,
+            # Lets the sorted index stop after the first match
+            "track_total_hits": False
         }
         if username:
-            query['query'] = { "term": { "username": username } }
-        global INDEX
-        search = list_documents(INDEX, query)
+            query['query'] = keyword_term("username", username)
+        # The current year is enough unless it has no match yet
+        search = list_documents(write_target(ENTITY), query)
+        if isinstance(search, Exception):
+            raise search
+        if len(search['hits']) == 0:
+            search = list_documents(read_alias(ENTITY), query)
+            if isinstance(search, Exception):
+                raise search
         if len(search['hits']) > 0:
             return { "_id": search['hits'][0]['_id'], **search['hits'][0]['_source'] }
         else:
             return False
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found @ most_recent_journey")
         return False
 
@@ -115,6 +293,85 @@ def most_recent_journey(username = None):
         print("Exception @ most_recent_journey\n{}".format(e))
         return None
 
+def active_journey_key(username):
+    """
+    Function to get the Redis key pointing at a user's active journey
+
+    Params:
+        username::str
+    Returns:
+        key::str
+    """
+    return "ActiveJourney_" + urlsafe_b64encode(username.encode('ascii')).decode()
+
+def _set_active(username, ID, timestamp, nx = False):
+    # The pointer expires when the journey becomes stale, never later
+    # nx keeps a pointer written meanwhile by create_journey / update_journey
+    if username:
+        ttl = min(ACTIVE_TTL, int(timestamp) + ACTIVE_TTL - int(time.time()))
+        if ttl > 0:
+            set_data({ "_id": ID, "timestamp": int(timestamp) }, active_journey_key(username), ttl, nx = nx)
+
+def _clear_active(username, ID):
+    if username:
+        pointer = get_data(active_journey_key(username))
+        if pointer and pointer.get('_id') in { ID, None }:
+            delete_key(active_journey_key(username))
+
+def active_journey(username):
+    """
+    Function to get the id of a user's active journey
+    Answered from the Redis pointer, Elasticsearch is only asked on a miss
+    Pointers to journeys older than the last deactivate_stale_journeys
+    cutoff are ignored
+
+    Params:
+        username::str
+    Returns:
+        ID::str
+            id of the active journey, False if there is none
+    """
+    if not username:
+        return False
+
+    try:
+        values = get_many([active_journey_key(username), ACTIVE_CUTOFF_KEY])
+        if values is None:
+            return None
+        pointer, cutoff = values
+        cutoff = cutoff['timestamp'] if cutoff else 0
+        if pointer and (not pointer['_id'] or pointer.get('timestamp', 0) >= cutoff):
+            return pointer['_id'] or False
+        if pointer:
+            # Older than the last stale sweep, dropped so the nx writes below can replace it
+            delete_key(active_journey_key(username))
+
+        query = {
+            "query": { "bool": { "filter": [
+                keyword_term("username", username),
+                { "term": { "is_active": True } },
+                { "range": { "timestamp": { "gte": cutoff, "format": "epoch_second" } } }
+            ] } },
+            "sort": [{ "timestamp": "desc" }],
+            "size": 1,
+            "track_total_hits": False
+        }
+        search = list_documents(read_alias(ENTITY), query)
+        if isinstance(search, Exception):
+            raise search
+        hit = search['hits'][0] if search['hits'] else None
+        if hit:
+            _set_active(username, hit['_id'], hit['_source']['timestamp'], nx = True)
+            return hit['_id']
+        # Remember there is none for a while, unless create_journey has
+        # written a pointer since the search
+        set_data({ "_id": None }, active_journey_key(username), NO_ACTIVE_TTL, nx = True)
+        return False
+
+    except Exception as e:
+        print("Exception @ active_journey\n{}".format(e))
+        return None
+
 def get_journey(ID):
     """
     Function to get one document from Elasticsearch
@@ -130,11 +387,12 @@ def get_journey(ID):
         return False
 
     try:
-        global INDEX
-        ref = get_document(INDEX, ID)
-        return { "_id": ref['_id'], **ref['_source'] }
+        ref = route_by_id(ENTITY, ID, lambda index: get_document(index, ID))
+        if isinstance(ref, Exception):
+            raise ref
+        return { "_id": ref['_id'], "_seq_no": ref['_seq_no'], "_primary_term": ref['_primary_term'], **ref['_source'] }
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found at get_journey")
         return False
 
@@ -142,7 +400,37 @@ def get_journey(ID):
         print("Exception @ get_journey\n{}".format(e))
         return None
 
-def update_journey(ID, changes):
+def get_journeys(IDs, fields = None):
+    """
+    Function to get many journey documents from Elasticsearch at once
+
+    Params:
+        IDs::[str]
+            ids of the journey documents
+        fields::[str]
+            Only return these fields of each document
+    Returns:
+        docs::[dict]
+            The documents found, in the order of IDs
+        missing::[str]
+            The ids which were not found
+    """
+    if not IDs or not isinstance(IDs, list):
+        return False
+
+    try:
+        found = get_many_by_id(ENTITY, IDs, fields)
+        if isinstance(found, Exception):
+            raise found
+        docs = [{ "_id": ID, **found[ID].get('_source', {}) } for ID in IDs if ID in found]
+        missing = [ID for ID in IDs if ID not in found]
+        return { "docs": docs, "missing": missing }
+
+    except Exception as e:
+        print("Exception @ get_journeys\n{}".format(e))
+        return None
+
+def update_journey(ID, changes, seqNo = None, primaryTerm = None):
     """
     Function to update a journey document in Elasticsearch
 
@@ -151,6 +439,10 @@ def update_journey(ID, changes):
             id of the document to update
         changes::dict
             Changes to be made to the document
+        seqNo::int
+            _seq_no from get_journey, to only update an unchanged document
+        primaryTerm::int
+            _primary_term from get_journey
     Returns:
         bool
             If the changes have been applied or not
@@ -159,18 +451,28 @@ def update_journey(ID, changes):
         return False
 
     try:
-        if '_id' in changes:
-            del changes['_id']
-        global INDEX
+        changes = { k: v for k, v in changes.items() if k not in { "_id", "_seq_no", "_primary_term" } }
         changes['updated_timestamp'] = int(time.time())
-        body = get_document(INDEX, ID)['_source']
-        create_or_update_document(INDEX, ID, { **body, **changes })
+        res = route_by_id(ENTITY, ID, lambda index: update_document(index, ID, changes, seqNo = seqNo, primaryTerm = primaryTerm, source = ["username", "timestamp"]))
+        if isinstance(res, Exception):
+            raise res
+        if 'is_active' in changes:
+            updated = res.get('get', {}).get('_source', {})
+            username = updated.get('username')
+            if changes['is_active']:
+                _set_active(username, ID, updated.get('timestamp', changes['updated_timestamp']))
+            else:
+                _clear_active(username, ID)
         return True
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found at update_journey")
         return False
 
+    except elastic_error("ConflictError"):
+        print("Document changed since it was read @ update_journey")
+        return False
+
     except Exception as e:
         print("Exception @ update_journey\n{}".format(e))
         return None
@@ -188,25 +490,42 @@ def add_halt_to_journey(ID, haltObj):
         bool
             If the changes have been applied or not
     """
-    if not ID or "station" not in haltObj:
+    if not ID or not haltObj or "station" not in haltObj:
+        return False
+
+    return add_halts_to_journey(ID, [haltObj])
+
+def add_halts_to_journey(ID, halts):
+    """
+    Function to append halts to the journey document in one request
+    The append runs inside Elasticsearch, halts already present with the
+    same station & timestamp are skipped
+
+    Params:
+        ID::str
+            id of the document to update
+        halts::[dict]
+            The halts to be added to the document
+    Returns:
+        bool
+            If the changes have been applied or not
+    """
+    if not ID or not halts or not all("station" in h for h in halts):
         return False
 
     try:
-        global INDEX
-        body = get_document(INDEX, ID)['_source']
-        if 'halts' in body and haltObj not in body['halts']:
-            body['halts'].append(haltObj)
-        else:
-            body['halts'] = [haltObj]
-        create_or_update_document(INDEX, ID, body)
+        _ensure_halts_script()
+        res = route_by_id(ENTITY, ID, lambda index: script_update_document(index, ID, ADD_HALTS_SCRIPT, { "halts": halts }))
+        if isinstance(res, Exception):
+            raise res
         return True
 
-    except NotFoundError:
-        print("No documents found at add_halt_to_journey")
+    except elastic_error("NotFoundError"):
+        print("No documents found at add_halts_to_journey")
         return False
 
     except Exception as e:
-        print("Exception @ add_halt_to_journey\n{}".format(e))
+        print("Exception @ add_halts_to_journey\n{}".format(e))
         return None
 
 def deactivate_journey(ID):
@@ -224,13 +543,13 @@ def deactivate_journey(ID):
         return False
 
     try:
-        global INDEX
-        body = get_document(INDEX, ID)['_source']
-        body['is_active'] = False
-        create_or_update_document(INDEX, ID, body)
+        res = route_by_id(ENTITY, ID, lambda index: update_document(index, ID, { "is_active": False }, source = "username"))
+        if isinstance(res, Exception):
+            raise res
+        _clear_active(res.get('get', {}).get('_source', {}).get('username'), ID)
         return True
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found at deactivate_journey")
         return False
 
@@ -238,6 +557,42 @@ def deactivate_journey(ID):
         print("Exception @ deactivate_journey\n{}".format(e))
         return None
 
+def deactivate_stale_journeys(hours = 24, requestsPerSecond = 500):
+    """
+    Function to deactivate every active journey older than some hours
+    Runs as a throttled background task in Elasticsearch, active journey
+    pointers to those journeys stop being trusted right away
+
+    Params:
+        hours::int
+            Age after which an active journey is deactivated
+        requestsPerSecond::int
+            Throttle, in documents per second
+    Returns:
+        taskID::str
+            The task deactivating the journeys, see utils.elastic.task_status
+    """
+    try:
+        now = int(time.time())
+        query = { "bool": { "filter": [
+            { "term": { "is_active": True } },
+            { "range": { "timestamp": { "lt": now - hours * 3600, "format": "epoch_second" } } }
+        ] } }
+        script = "ctx._source.is_active = false; ctx._source.updated_timestamp = params.now;"
+        taskID = update_by_query(read_alias(ENTITY), query, script, { "now": now }, requestsPerSecond)
+        if isinstance(taskID, Exception):
+            raise taskID
+        cutoff = now - hours * 3600
+        current = get_data(ACTIVE_CUTOFF_KEY)
+        if not current or current['timestamp'] < cutoff:
+            # Pointers live at most ACTIVE_TTL, so the cutoff can expire with them
+            set_data({ "timestamp": cutoff }, ACTIVE_CUTOFF_KEY, ACTIVE_TTL)
+        return taskID
+
+    except Exception as e:
+        print("Exception @ deactivate_stale_journeys\n{}".format(e))
+        return None
+
 def delete_journey(ID):
     """
     Function to delete a journey document on Elasticsearch
@@ -250,11 +605,16 @@ def delete_journey(ID):
             If the document is deleted or not
     """
     try:
-        global INDEX
-        delete_document(INDEX, ID)
+        ref = route_by_id(ENTITY, ID, lambda index: get_document(index, ID))
+        if isinstance(ref, Exception):
+            raise ref
+        res = delete_document(ref['_index'], ID)
+        if isinstance(res, Exception):
+            raise res
+        _clear_active(ref['_source'].get('username'), ID)
         return True
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found at delete_journey")
         return False
 
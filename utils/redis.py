@@ -8,17 +8,26 @@ Functions:
     - set_data
     - get_data
     - delete_key
+    - get_many
+    - set_many
+    - delete_many
+    - batch
+    - add_members
+    - remove_members
+    - is_member
+    - get_members
+    - key_exists
+    - increment
+    - set_if_missing
 """
-import json
 import time
-from redis import Redis
 from base64 import urlsafe_b64encode
+from contextlib import contextmanager
 
-from constants import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
+from .codec import encode, decode
+from .clients import redis_client
 
-rds = Redis(host = REDIS_HOST, port = REDIS_PORT, password = REDIS_PASSWORD)
-
-def set_data(data, key = None):
+def set_data(data, key = None, ttl = None, nx = False):
     """
     Function to create a Redis key
 
@@ -27,9 +36,14 @@ def set_data(data, key = None):
             The data to be cached
         key::str
             The key to store the data in
+        ttl::int
+            Seconds after which Redis expires the key
+        nx::bool
+            Only store the data if the key does not exist
     Returns:
         cacheKey::str
-            The cacheKey in which the data has been stored
+            The cacheKey in which the data has been stored, False if nx
+            is set and the key already exists
 
     """
     if not data:
@@ -48,7 +62,8 @@ def set_data(data, key = None):
             else:
                 # Data is not dict or "username" is not present
                 cacheKey = "MiscCache_" + str(int(time.time()))
-        rds.set(cacheKey, json.dumps(data))
+        if not redis_client().set(cacheKey, encode(data), ex = ttl, nx = nx):
+            return False
         return cacheKey
 
     except Exception as e:
@@ -70,7 +85,8 @@ def get_data(key):
         return False
 
     try:
-        return json.loads(rds.get(key).decode())
+        raw = redis_client().get(key)
+        return decode(raw)
 
     except Exception as e:
         print("Exception @ get_data\n{}".format(e))
@@ -91,9 +107,262 @@ def delete_key(key):
         return False
 
     try:
-        rds.delete(key)
+        redis_client().delete(key)
         return True
 
     except Exception as e:
         print("Exception @ delete_key\n{}".format(e))
-        return None
\ No newline at end of file
+        return None
+
+def get_many(keys):
+    """
+    Retrieve many keys from Redis with one MGET
+
+    Params:
+        keys::[str]
+            The cache keys to fetch
+    Returns:
+        data::[dict]
+            The data stored in each key, None for missing keys
+    """
+    if not keys:
+        return False
+
+    try:
+        return [decode(raw) for raw in redis_client().mget(keys)]
+
+    except Exception as e:
+        print("Exception @ get_many\n{}".format(e))
+        return None
+
+def set_many(data, ttl = None):
+    """
+    Function to store many keys in Redis in one round trip
+
+    Params:
+        data::dict
+            The data to be cached, by key
+        ttl::int|dict
+            Seconds after which Redis expires the keys, or per key
+    Returns:
+        bool
+            If the keys have been stored or not
+    """
+    if not data or not isinstance(data, dict):
+        return False
+
+    try:
+        if ttl is None:
+            redis_client().mset({ key: encode(val) for key, val in data.items() })
+            return True
+        pipe = redis_client().pipeline(transaction = False)
+        for key, val in data.items():
+            pipe.set(key, encode(val), ex = ttl.get(key) if isinstance(ttl, dict) else ttl)
+        pipe.execute()
+        return True
+
+    except Exception as e:
+        print("Exception @ set_many\n{}".format(e))
+        return None
+
+def delete_many(keys):
+    """
+    Function to delete many keys in Redis with one DEL
+
+    Params:
+        keys::[str]
+            The cache keys to delete
+    Returns:
+        bool
+            If the keys have been deleted or not
+    """
+    if not keys:
+        return False
+
+    try:
+        redis_client().delete(*keys)
+        return True
+
+    except Exception as e:
+        print("Exception @ delete_many\n{}".format(e))
+        return None
+
+@contextmanager
+def batch():
+    """
+    Context manager sending every command of the block in one round trip
+    Results are filled in when the block exits
+
+        with batch() as (pipe, results):
+            pipe.get("a")
+            pipe.sismember("b", "c")
+        a, c = results
+
+    Yields:
+        pipe::redis.client.Pipeline
+            Queue commands on it
+        results::list
+            The replies, in order, once the block has exited
+    """
+    pipe = redis_client().pipeline(transaction = False)
+    results = []
+    yield pipe, results
+    results.extend(pipe.execute())
+
+def add_members(key, members):
+    """
+    Function to add members to a Redis set
+
+    Params:
+        key::str
+            The set key
+        members::[str]
+            The members to add
+    Returns:
+        added::int
+            The number of members that were not already in the set
+    """
+    if not key or not members:
+        return False
+
+    try:
+        return redis_client().sadd(key, *members)
+
+    except Exception as e:
+        print("Exception @ add_members\n{}".format(e))
+        return None
+
+def remove_members(key, members):
+    """
+    Function to remove members from a Redis set
+
+    Params:
+        key::str
+            The set key
+        members::[str]
+            The members to remove
+    Returns:
+        removed::int
+            The number of members removed from the set
+    """
+    if not key or not members:
+        return False
+
+    try:
+        return redis_client().srem(key, *members)
+
+    except Exception as e:
+        print("Exception @ remove_members\n{}".format(e))
+        return None
+
+def is_member(key, member):
+    """
+    Function to check if a member is present in a Redis set
+
+    Params:
+        key::str
+            The set key
+        member::str
+            The member to look up
+    Returns:
+        bool
+            If the member is in the set or not
+    """
+    if not key or not member:
+        return False
+
+    try:
+        return bool(redis_client().sismember(key, member))
+
+    except Exception as e:
+        print("Exception @ is_member\n{}".format(e))
+        return None
+
+def get_members(key):
+    """
+    Function to get all members of a Redis set
+
+    Params:
+        key::str
+            The set key
+    Returns:
+        members::[str]
+            The members of the set
+    """
+    if not key:
+        return False
+
+    try:
+        return [m.decode() for m in redis_client().smembers(key)]
+
+    except Exception as e:
+        print("Exception @ get_members\n{}".format(e))
+        return None
+
+def key_exists(key):
+    """
+    Function to check if a key exists in Redis
+
+    Params:
+        key::str
+            The cache key to check
+    Returns:
+        bool
+            If the key exists or not
+    """
+    if not key:
+        return False
+
+    try:
+        return redis_client().exists(key) > 0
+
+    except Exception as e:
+        print("Exception @ key_exists\n{}".format(e))
+        return None
+
+def increment(key, amount = 1):
+    """
+    Function to atomically increment an integer key in Redis
+    Missing keys start at 0
+
+    Params:
+        key::str
+            The counter key
+        amount::int
+            The amount to add
+    Returns:
+        value::int
+            The value after the increment
+    """
+    if not key:
+        return False
+
+    try:
+        return redis_client().incrby(key, amount)
+
+    except Exception as e:
+        print("Exception @ increment\n{}".format(e))
+        return None
+
+def set_if_missing(key, value):
+    """
+    Function to set a Redis key only if it does not exist yet
+
+    Params:
+        key::str
+            The cache key to set
+        value::str|int
+            The raw value to store
+    Returns:
+        bool
+            If the key was set or not
+    """
+    if not key:
+        return False
+
+    try:
+        return bool(redis_client().setnx(key, value))
+
+    except Exception as e:
+        print("Exception @ set_if_missing\n{}".format(e))
+        return None
@@ -0,0 +1,277 @@
+"""
+Session Utils
+=============
+
+All utility functions to manage login sessions
+Sessions live in Redis with a native expiry, under a random token
+Each user also has a pointer to their current token, so a user can be
+logged out by username
+Tokens that were validated recently are trusted from a small in-process
+cache for a few seconds
+
+Functions
+    - session_key
+    - user_session_key
+    - create_session
+    - validate_session
+    - validate_session_with
+    - end_session
+    - end_user_session
+    - bearer_token
+    - authorized
+"""
+import time
+import secrets
+from threading import Lock
+from functools import wraps
+from collections import OrderedDict
+from base64 import urlsafe_b64encode
+
+from .redis import get_data, get_many, set_many, delete_key, delete_many
+
+SESSION_TTL = 7200 # Session expiry in 2hrs
+LOCAL_TTL = 15 # Seconds a validated token is trusted without asking Redis
+LOCAL_SIZE = 1024 # Max tokens held in the local cache
+TOKEN_BYTES = 32 # Random bytes in a session token
+
+_local = OrderedDict()
+_lock = Lock()
+
+def _local_get(token):
+    with _lock:
+        entry = _local.get(token)
+        if entry is None:
+            return None
+        session, checkedAt = entry
+        now = time.time()
+        if now - checkedAt > LOCAL_TTL or session['expiry_timestamp'] < now:
+            del _local[token]
+            return None
+        _local.move_to_end(token)
+        return session
+
+def _local_set(token, session):
+    with _lock:
+        _local[token] = (session, time.time())
+        _local.move_to_end(token)
+        while len(_local) > LOCAL_SIZE:
+            _local.popitem(last = False)
+
+def _local_delete(token):
+    with _lock:
+        _local.pop(token, None)
+
+def session_key(token):
+    """
+    Function to get the Redis key of a session
+
+    Params:
+        token::str
+            The session token
+    Returns:
+        key::str
+            The Redis key of the session
+    """
+    return "Session_" + token
+
+def user_session_key(username):
+    """
+    Function to get the Redis key pointing to the current session of a user
+
+    Params:
+        username::str
+    Returns:
+        key::str
+            The Redis key holding the user's session token
+    """
+    return "UserSession_" + urlsafe_b64encode(username.encode('ascii')).decode()
+
+def create_session(username, ttl = SESSION_TTL):
+    """
+    Function to create a login session, expired by Redis after ttl seconds
+    The token is random, a previous session of the user is ended
+
+    Params:
+        username::str
+        ttl::int
+            Seconds until the session expires
+    Returns:
+        key::str
+            The session token
+        expiry_timestamp::int
+            The unix timestamp of session expiry
+    """
+    if not username:
+        return False
+
+    try:
+        session = {
+            "username": username,
+            "login_timestamp": int(time.time()), # Session timestamp
+            "expiry_timestamp": int(time.time()) + ttl
+        }
+        token = secrets.token_urlsafe(TOKEN_BYTES)
+        pointer = user_session_key(username)
+        previous = get_data(pointer)
+        if previous and previous.get('token'):
+            end_session(previous['token'])
+        if not set_many({ session_key(token): session, pointer: { "token": token } }, ttl):
+            return None
+        _local_set(token, session)
+        return { "key": token, "expiry_timestamp": session['expiry_timestamp'] }
+
+    except Exception as e:
+        print("Exception @ create_session\n{}".format(e))
+        return None
+
+def validate_session(token, username = None):
+    """
+    Function to validate a session token
+    If username is passed, checks if session is for that user
+
+    Params:
+        token::str
+            The session token to validate
+        username::str
+    Returns:
+        session::dict
+            The session object, False if the token is invalid
+    """
+    if not token:
+        return False
+
+    try:
+        session = _local_get(token)
+        if session is None:
+            session = get_data(session_key(token))
+            if not session or session['expiry_timestamp'] < int(time.time()):
+                return False
+            _local_set(token, session)
+        if username and session['username'] != username:
+            return False
+        return session
+
+    except Exception as e:
+        print("Exception @ validate_session\n{}".format(e))
+        return None
+
+def validate_session_with(token, keys):
+    """
+    Function to validate a session token and read other keys with it
+    Token and keys are fetched with one MGET, eg. session & user cache
+
+    Params:
+        token::str
+            The session token to validate
+        keys::[str]
+            Other cache keys to fetch
+    Returns:
+        session::dict
+            The session object, False if the token is invalid
+        data::[dict]
+            The data stored in each key, None for missing keys
+    """
+    if not token:
+        return False
+
+    try:
+        values = get_many([session_key(token)] + list(keys))
+        if values is None:
+            return None
+        session = values[0]
+        if not session or session['expiry_timestamp'] < int(time.time()):
+            return { "session": False, "data": values[1:] }
+        _local_set(token, session)
+        return { "session": session, "data": values[1:] }
+
+    except Exception as e:
+        print("Exception @ validate_session_with\n{}".format(e))
+        return None
+
+def end_session(token):
+    """
+    Function to end a session
+
+    Params:
+        token::str
+            The session token to delete
+    Returns:
+        bool
+            If the session has been deleted or not
+    """
+    if not token:
+        return False
+
+    _local_delete(token)
+    return delete_key(session_key(token))
+
+def end_user_session(username):
+    """
+    Function to end the current session of a user
+
+    Params:
+        username::str
+    Returns:
+        bool
+            If the session has been deleted or not
+    """
+    if not username:
+        return False
+
+    try:
+        pointer = user_session_key(username)
+        current = get_data(pointer)
+        if current is None:
+            return delete_key(pointer)
+        _local_delete(current['token'])
+        return delete_many([session_key(current['token']), pointer])
+
+    except Exception as e:
+        print("Exception @ end_user_session\n{}".format(e))
+        return None
+
+def bearer_token(event):
+    """
+    Function to read the bearer token from a request event
+
+    Params:
+        event::dict
+            The request event
+    Returns:
+        token::str
+            The token, None if not present
+    """
+    headers = event.get('headers') or {}
+    auth = headers.get('Authorization') or headers.get('authorization')
+    if not auth or not isinstance(auth, str):
+        return None
+    token = auth.replace("Bearer ", "").strip()
+    return token if token else None
+
+def authorized(handler):
+    """
+    Decorator for handlers which require a logged in user
+    The validated session is passed to the handler as event['session']
+
+    Params:
+        handler::function
+            The handler to wrap
+    Returns:
+        wrapper::function
+            The wrapped handler
+    """
+    @wraps(handler)
+    def wrapper(event, context):
+        if not event or not isinstance(event, dict):
+            return { "status": 400 }
+        token = bearer_token(event)
+        if not token:
+            return { "status": 401 }
+        session = validate_session(token)
+        if session is None:
+            return { "status": 500 }
+        if not session:
+            return { "status": 401 }
+        event['session'] = { **session, "key": token }
+        return handler(event, context)
+    return wrapper
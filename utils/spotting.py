@@ -3,26 +3,131 @@ Spotting Utils
 ==============
 
 All utility functions to manage spotting documents in Elasticsearch
-The index used is "user-spottings-<current year>"
+Documents are written to "user-spottings-<current year>" through the
+write alias and read from every year through the read alias
 
 Functions
+    - create_spotting_template
+    - update_spotting_mappings
     - create_spotting
+    - create_spottings
     - list_spottings
+    - iter_spottings
     - get_spotting
+    - get_spottings
+    - most_recent_spotting
+    - nearby_spottings
+    - spotting_clusters
+    - next_spotting_id
+    - reserve_spotting_ids
     - update_spotting
     - deactivate_spotting
     - delete_spotting
 """
 import time
-from elasticsearch import NotFoundError
 
-from .elastic import create_or_update_document, list_documents, get_document, delete_document
+from .ids import next_id, reserve_ids
+from .stats import invalidate_user_stats
+from .indexes import yearly_index, write_target, read_alias, route_by_id, get_many_by_id, keyword_term
+from .elastic import elastic_error, list_indexes, put_mapping, update_by_query, aggregate, bulk_index, create_or_update_document, list_documents, search_page, iter_documents, get_document, update_document, put_index_template, delete_document
+
+ENTITY = "spottings"
+ID_COUNTER = "SpottingIdCounter"
+
+TEMPLATE = {
+    "index_patterns": ["user-spottings-*"],
+    "template": {
+        "aliases": { "user-spottings": {} },
+        "settings": {
+            "number_of_shards": 1,
+            "number_of_replicas": 1,
+            "refresh_interval": "5s",
+            # Documents are stored newest first, so "most recent" queries stop early
+            "sort.field": "timestamp",
+            "sort.order": "desc"
+        },
+        "mappings": {
+            # Unknown fields are kept in _source but not indexed
+            "dynamic": False,
+            "properties": {
+                "username": { "type": "keyword" },
+                "spotting_category": { "type": "keyword" },
+                "spotting_location": { "type": "text" },
+                "spotting_coordinates": { "type": "geo_point" },
+                "loco_number": { "type": "keyword" },
+                "loco_class": { "type": "keyword" },
+                "loco_shed": { "type": "keyword" },
+                "train_number": { "type": "keyword" },
+                "train_name": { "type": "text", "fields": { "raw": { "type": "keyword" } } },
+                "is_active": { "type": "boolean" },
+                "timestamp": { "type": "date", "format": "epoch_second" },
+                "updated_timestamp": { "type": "date", "format": "epoch_second" }
+            }
+        }
+    }
+}
+
+def create_spotting_template():
+    """
+    Function to create the index template of the yearly spotting indexes
+    Only applies to indexes created after it, existing ones must be reindexed
 
-INDEX = "user-spottings-" + time.strftime("%Y")
+    Returns:
+        bool
+            If the template was created or not
+    """
+    try:
+        res = put_index_template("user-spottings", TEMPLATE)
+        if isinstance(res, Exception):
+            raise res
+        return True
+
+    except Exception as e:
+        print("Exception @ create_spotting_template\n{}".format(e))
+        return None
+
+def update_spotting_mappings(requestsPerSecond = 500):
+    """
+    Function to add spotting_coordinates as geo_point to the yearly indexes
+    created before it was in the template
+    Documents already stored are reindexed in place by a background task,
+    so their coordinates become searchable
+
+    Params:
+        requestsPerSecond::int
+            Throttle of the reindex, in documents per second
+    Returns:
+        updated::dict
+            The reindex task of each updated index, see task_status
+        failed::dict
+            The error of each index which could not be updated, eg. because
+            the field was already mapped as an object
+    """
+    try:
+        indexes = list_indexes(yearly_index(ENTITY, "*"))
+        if isinstance(indexes, Exception):
+            raise indexes
+        properties = { "spotting_coordinates": TEMPLATE['template']['mappings']['properties']['spotting_coordinates'] }
+        updated = {}
+        failed = {}
+        for index in indexes:
+            res = put_mapping(index, properties)
+            if not isinstance(res, Exception):
+                res = update_by_query(index, { "match_all": {} }, None, requestsPerSecond = requestsPerSecond)
+            if isinstance(res, Exception):
+                failed[index] = str(res)
+            else:
+                updated[index] = res
+        return { "updated": updated, "failed": failed }
+
+    except Exception as e:
+        print("Exception @ update_spotting_mappings\n{}".format(e))
+        return None
 
 def create_spotting(ID, body):
     """
     Function to create a new spotting document in Elasticsearch
+    Fails if a spotting with the same ID already exists
 
     Params:
         ID::str
@@ -42,42 +147,126 @@ def create_spotting(ID, body):
             body['timestamp'] = int(time.time())
         if 'is_active' not in body:
             body['is_active'] = True
-        global INDEX
-        create_or_update_document(INDEX, ID, body)
+        res = create_or_update_document(write_target(ENTITY), ID, body, opType = "create")
+        if isinstance(res, Exception):
+            raise res
+        invalidate_user_stats(body['username'])
         return True
 
+    except elastic_error("ConflictError"):
+        print("Spotting {} already exists @ create_spotting".format(ID))
+        return False
+
     except Exception as e:
         print("Exception @ create_spotting\n{}".format(e))
         return None
 
-def list_spottings(includeInactive = False):
+def create_spottings(docs, threads = 1):
+    """
+    Function to create many spotting documents in Elasticsearch with the bulk API
+    IDs which already exist are reported in errors, not overwritten
+
+    Params:
+        docs::[(str, dict)]
+            (ID, body) of each spotting document
+        threads::int
+            Number of bulk requests sent in parallel
+    Returns:
+        created::int
+            Number of documents created
+        errors::[dict]
+            The documents which could not be created
+    """
+    if not docs:
+        return False
+
+    try:
+        now = int(time.time())
+        invalid = []
+        index = write_target(ENTITY)
+        def actions():
+            for ID, body in docs:
+                # Required fields check
+                if not ID or not body or not {"username", "spotting_category"}.issubset(body):
+                    invalid.append({ "_id": ID, "error": "Missing required fields" })
+                    continue
+                yield index, ID, { "timestamp": now, "is_active": True, **body }
+        res = bulk_index(actions(), threads = threads, opType = "create")
+        if isinstance(res, Exception):
+            raise res
+        for username in { body['username'] for ID, body in docs if body and 'username' in body }:
+            invalidate_user_stats(username)
+        return { "created": res['indexed'], "errors": invalid + res['errors'] }
+
+    except Exception as e:
+        print("Exception @ create_spottings\n{}".format(e))
+        return None
+
+def _filter_query(includeInactive = False, since = None, until = None):
+    filters = [] if includeInactive else [{ "term": { "is_active": True } }]
+    if since is not None or until is not None:
+        bounds = { "format": "epoch_second" }
+        if since is not None:
+            bounds['gte'] = since
+        if until is not None:
+            bounds['lte'] = until
+        filters.append({ "range": { "timestamp": bounds } })
+    return { "query": { "bool": { "filter": filters } } } if filters else {}
+
+def list_spottings(includeInactive = False, size = 50, cursor = None, since = None, until = None):
     """
-    Function to list all spotting documents from Elasticsearch
+    Function to list the spotting documents in Elasticsearch, one page at a time
 
     Params:
         includeInactive::bool
             If inactive records must be included in the result or not
+        size::int
+            Documents per page
+        cursor::str
+            Cursor returned with the previous page
+        since::int
+            Only documents from this unix timestamp on
+        until::int
+            Only documents up to this unix timestamp
     Returns:
         total_docs::int
-            The total number of records
+            The total number of records, only on the first page
         docs::[dict]
             The list of documents
+        cursor::str
+            Cursor of the next page, None on the last page
     """
     try:
-        query = {} if includeInactive else { "query": { "term": { "is_active": True } } }
-        global INDEX
-        search = list_documents(INDEX, query)
-        docs = [{ "_id": hit['_id'], **hit['_source'] } for hit in search['hits']]
-        return { "total_docs": len(docs), "docs": docs }
-
-    except NotFoundError:
-        print("No documents found at list_journeys")
+        query = _filter_query(includeInactive, since, until)
+        page = search_page(read_alias(ENTITY), query, size, cursor)
+        if isinstance(page, Exception):
+            raise page
+        docs = [{ "_id": hit['_id'], **hit['_source'] } for hit in page['hits']]
+        return { "total_docs": page['total'], "docs": docs, "cursor": page['cursor'] }
+
+    except elastic_error("NotFoundError"):
+        print("No documents found at list_spottings")
         return False
 
     except Exception as e:
         print("Exception @ list_spottings\n{}".format(e))
         return None
 
+def iter_spottings(includeInactive = False):
+    """
+    Generator to stream every spotting document in Elasticsearch
+
+    Params:
+        includeInactive::bool
+            If inactive records must be included in the result or not
+    Yields:
+        doc::dict
+            One spotting document
+    """
+    query = _filter_query(includeInactive)
+    for hit in iter_documents(read_alias(ENTITY), query):
+        yield { "_id": hit['_id'], **hit['_source'] }
+
 def get_spotting(ID):
     """
     Function to get one spotting document from Elasticsearch
@@ -93,11 +282,12 @@ def get_spotting(ID):
         return False
 
     try:
-        global INDEX
-        ref = get_document(INDEX, ID)
-        return { "_id": ref['_id'], **ref['_source'] }
+        ref = route_by_id(ENTITY, ID, lambda index: get_document(index, ID))
+        if isinstance(ref, Exception):
+            raise ref
+        return { "_id": ref['_id'], "_seq_no": ref['_seq_no'], "_primary_term": ref['_primary_term'], **ref['_source'] }
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found at get_spotting")
         return False
 
@@ -105,6 +295,36 @@ def get_spotting(ID):
         print("Exception @ get_spotting\n{}".format(e))
         return None
 
+def get_spottings(IDs, fields = None):
+    """
+    Function to get many spotting documents from Elasticsearch at once
+
+    Params:
+        IDs::[str]
+            ids of the spotting documents
+        fields::[str]
+            Only return these fields of each document
+    Returns:
+        docs::[dict]
+            The documents found, in the order of IDs
+        missing::[str]
+            The ids which were not found
+    """
+    if not IDs or not isinstance(IDs, list):
+        return False
+
+    try:
+        found = get_many_by_id(ENTITY, IDs, fields)
+        if isinstance(found, Exception):
+            raise found
+        docs = [{ "_id": ID, **found[ID].get('_source', {}) } for ID in IDs if ID in found]
+        missing = [ID for ID in IDs if ID not in found]
+        return { "docs": docs, "missing": missing }
+
+    except Exception as e:
+        print("Exception @ get_spottings\n{}".format(e))
+        return None
+
 def most_recent_spotting(username = None):
     """
     Function to retrieve most recent spotting document from Elasticsearch
@@ -121,18 +341,26 @@ def most_recent_spotting(username = None):
             "sort": [
                 { "timestamp": "desc" }
             ],
-            "size": 1
+            "size": 1,
+            # Lets the sorted index stop after the first match
+            "track_total_hits": False
         }
         if username:
-            query['query'] = { "term": { "username": username } }
-        global INDEX
-        search = list_documents(INDEX, query)
+            query['query'] = keyword_term("username", username)
+        # The current year is enough unless it has no match yet
+        search = list_documents(write_target(ENTITY), query)
+        if isinstance(search, Exception):
+            raise search
+        if len(search['hits']) == 0:
+            search = list_documents(read_alias(ENTITY), query)
+            if isinstance(search, Exception):
+                raise search
         if len(search['hits']) > 0:
             return { "_id": search['hits'][0]['_id'], **search['hits'][0]['_source'] }
         else:
             return False
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found @ most_recent_spotting")
         return False
 
@@ -140,7 +368,137 @@ def most_recent_spotting(username = None):
         print("Exception @ most_recent_spotting\n{}".format(e))
         return None
 
-def update_spotting(ID, changes):
+def nearby_spottings(lat, lon, radius = "5km", size = 50):
+    """
+    Function to find the active spottings around a location, nearest first
+
+    Params:
+        lat::float
+        lon::float
+        radius::str
+            Max distance, eg. "500m" or "10km"
+        size::int
+            Max documents to return
+    Returns:
+        docs::[dict]
+            The documents, with their "distance" in km
+    """
+    try:
+        point = { "lat": lat, "lon": lon }
+        query = {
+            "query": { "bool": { "filter": [
+                { "term": { "is_active": True } },
+                # Indexes without the geo_point mapping match nothing instead of failing
+                { "geo_distance": { "distance": radius, "spotting_coordinates": point, "ignore_unmapped": True } }
+            ] } },
+            "sort": [{ "_geo_distance": { "spotting_coordinates": point, "order": "asc", "unit": "km", "ignore_unmapped": True } }],
+            "size": size,
+            "track_total_hits": False
+        }
+        search = list_documents(read_alias(ENTITY), query)
+        if isinstance(search, Exception):
+            raise search
+        return [{ "_id": hit['_id'], "distance": hit['sort'][0], **hit['_source'] } for hit in search['hits']]
+
+    except Exception as e:
+        print("Exception @ nearby_spottings\n{}".format(e))
+        return None
+
+def spotting_clusters(top, left, bottom, right, precision = 5):
+    """
+    Function to group the active spottings inside a map view into geohash cells
+
+    Params:
+        top::float
+            Latitude of the top edge
+        left::float
+            Longitude of the left edge
+        bottom::float
+            Latitude of the bottom edge
+        right::float
+            Longitude of the right edge
+        precision::int
+            Geohash length, 1 (continent) to 12 (a few cm)
+    Returns:
+        clusters::[dict]
+            geohash, count and centroid lat / lon of each cell
+    """
+    try:
+        query = { "bool": { "filter": [
+            { "term": { "is_active": True } },
+            { "geo_bounding_box": {
+                "spotting_coordinates": {
+                    "top_left": { "lat": top, "lon": left },
+                    "bottom_right": { "lat": bottom, "lon": right }
+                },
+                "ignore_unmapped": True
+            } }
+        ] } }
+        aggs = { "cells": {
+            "geohash_grid": { "field": "spotting_coordinates", "precision": precision, "size": 1000 },
+            "aggs": { "centroid": { "geo_centroid": { "field": "spotting_coordinates" } } }
+        } }
+        res = aggregate(read_alias(ENTITY), query, aggs)
+        if isinstance(res, Exception):
+            raise res
+        return [
+            {
+                "geohash": b['key'],
+                "count": b['doc_count'],
+                "lat": b['centroid']['location']['lat'],
+                "lon": b['centroid']['location']['lon']
+            }
+            for b in res['aggregations']['cells']['buckets']
+        ]
+
+    except Exception as e:
+        print("Exception @ spotting_clusters\n{}".format(e))
+        return None
+
+def _last_spotting_number():
+    # Highest id in use, newer documents do not always have higher ids
+    # Only runs when the counter is missing, so a full id scan is fine
+    try:
+        last = 0
+        for hit in iter_documents(read_alias(ENTITY), { "_source": False, "sort": [] }, 5000):
+            ID = hit['_id']
+            if ID.startswith("SPOT") and ID[4:].isdigit():
+                last = max(last, int(ID[4:]))
+        return last
+
+    except elastic_error("NotFoundError"):
+        return 0
+
+    except Exception as e:
+        print("Exception @ _last_spotting_number\n{}".format(e))
+        return None
+
+def next_spotting_id():
+    """
+    Function to allocate the id for a new spotting document
+
+    Returns:
+        ID::str
+            The spotting id, eg. "SPOT0042"
+    """
+    num = next_id(ID_COUNTER, _last_spotting_number)
+    return "SPOT" + str(num).zfill(4) if num else None
+
+def reserve_spotting_ids(count):
+    """
+    Function to reserve ids for many spotting documents, eg. for imports
+
+    Params:
+        count::int
+            Number of ids to reserve
+    Returns:
+        IDs::[str]
+            The reserved spotting ids
+    """
+    ids = reserve_ids(ID_COUNTER, count, _last_spotting_number)
+    return ["SPOT" + str(num).zfill(4) for num in ids] if ids else ids
+
+def update_spotting(ID, changes, seqNo = None, primaryTerm = None):
     """
     Function to update a spotting document in Elasticsearch
 
@@ -149,6 +507,10 @@ def update_spotting(ID, changes):
             id of the document to update
         changes::dict
             Changes to be made to the document
+        seqNo::int
+            _seq_no from get_spotting, to only update an unchanged document
+        primaryTerm::int
+            _primary_term from get_spotting
     Returns:
         bool
             If the changes have been applied or not
@@ -157,18 +519,22 @@ def update_spotting(ID, changes):
         return False
 
     try:
-        if '_id' in changes:
-            del changes['_id']
-        global INDEX
+        changes = { k: v for k, v in changes.items() if k not in { "_id", "_seq_no", "_primary_term" } }
         changes['updated_timestamp'] = int(time.time())
-        body = get_document(INDEX, ID)['_source']
-        create_or_update_document(INDEX, ID, { **body, **changes })
+        res = route_by_id(ENTITY, ID, lambda index: update_document(index, ID, changes, seqNo = seqNo, primaryTerm = primaryTerm, source = "username"))
+        if isinstance(res, Exception):
+            raise res
+        invalidate_user_stats(res.get('get', {}).get('_source', {}).get('username'))
         return True
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found at update_spotting")
         return False
 
+    except elastic_error("ConflictError"):
+        print("Document changed since it was read @ update_spotting")
+        return False
+
     except Exception as e:
         print("Exception @ update_spotting\n{}".format(e))
         return None
@@ -188,13 +554,13 @@ def deactivate_spotting(ID):
         return False
 
     try:
-        global INDEX
-        body = get_document(INDEX, ID)['_source']
-        body['is_active'] = False
-        create_or_update_document(INDEX, ID, body)
+        res = route_by_id(ENTITY, ID, lambda index: update_document(index, ID, { "is_active": False }, source = "username"))
+        if isinstance(res, Exception):
+            raise res
+        invalidate_user_stats(res.get('get', {}).get('_source', {}).get('username'))
         return True
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found at deactivate_spotting")
         return False
 
@@ -214,11 +580,12 @@ def delete_spotting(ID):
             If the document is deleted or not
     """
     try:
-        global INDEX
-        delete_document(INDEX, ID)
+        res = route_by_id(ENTITY, ID, lambda index: delete_document(index, ID))
+        if isinstance(res, Exception):
+            raise res
         return True
 
-    except NotFoundError:
+    except elastic_error("NotFoundError"):
         print("No documents found at delete_spotting")
         return False
 
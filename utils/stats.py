@@ -0,0 +1,111 @@
+"""
+Stats Utils
+===========
+
+Per-user statistics computed with Elasticsearch aggregations
+Summaries are cached in Redis and invalidated when the user's spottings change
+
+Functions
+    - stats_key
+    - user_stats
+    - invalidate_user_stats
+"""
+import time
+from base64 import urlsafe_b64encode
+
+from .redis import set_data, get_data
+from .elastic import aggregate
+from .indexes import read_alias, keyword_term, runtime_fields
+
+STATS_TTL = 86400 # Cached summaries are recomputed at least daily
+STALE_TTL = 10 # Longer than the index refresh interval
+
+def stats_key(username):
+    """
+    Function to get the Redis key of a user's cached statistics
+
+    Params:
+        username::str
+    Returns:
+        key::str
+    """
+    return "StatsCache_" + urlsafe_b64encode(username.encode('ascii')).decode()
+
+def _buckets(agg):
+    return { str(b.get('key_as_string', b['key'])): b['doc_count'] for b in agg['buckets'] }
+
+def user_stats(username):
+    """
+    Function to get the spotting statistics of a user
+
+    Params:
+        username::str
+    Returns:
+        total_spottings::int
+            Number of active spottings
+        categories::dict
+            Spottings per spotting_category
+        loco_classes::dict
+            Spottings per loco_class
+        months::dict
+            Spottings per month, as "YYYY-MM"
+    """
+    if not username:
+        return False
+
+    try:
+        key = stats_key(username)
+        cached = get_data(key)
+        if cached and not cached.get('stale'):
+            return cached
+
+        query = { "bool": { "filter": [
+            keyword_term("username", username),
+            { "term": { "is_active": True } }
+        ] } }
+        aggs = {
+            "categories": { "terms": { "field": "spotting_category", "size": 20 } },
+            "loco_classes": { "terms": { "field": "loco_class", "size": 50 } },
+            "months": { "date_histogram": {
+                "field": "timestamp", "calendar_interval": "month", "format": "yyyy-MM", "min_doc_count": 1
+            } }
+        }
+        # Older indexes map these as text / long, read them from _source instead
+        runtime = runtime_fields(["spotting_category", "loco_class"], ["timestamp"])
+        res = aggregate(read_alias("spottings"), query, aggs, runtime)
+        if isinstance(res, Exception):
+            raise res
+        summary = {
+            "username": username,
+            "total_spottings": res['total'],
+            "categories": _buckets(res['aggregations']['categories']),
+            "loco_classes": _buckets(res['aggregations']['loco_classes']),
+            "months": _buckets(res['aggregations']['months']),
+            "timestamp": int(time.time())
+        }
+        if not cached:
+            # Right after a change the new document may not be searchable yet
+            # NX keeps a stale marker written while this summary was computed
+            set_data(summary, key, STATS_TTL, nx = True)
+        return summary
+
+    except Exception as e:
+        print("Exception @ user_stats\n{}".format(e))
+        return None
+
+def invalidate_user_stats(username):
+    """
+    Function to drop the cached statistics of a user
+    The key is marked stale for a few seconds instead of deleted, so a
+    summary computed before the index refresh is not cached
+
+    Params:
+        username::str
+    Returns:
+        bool
+            If the cache was invalidated or not
+    """
+    if not username:
+        return False
+
+    return bool(set_data({ "stale": True }, stats_key(username), STALE_TTL))
@@ -9,18 +9,31 @@ Functions
     - signup_user
     - login_user
     - logout_user
+    - username_exists
     - existing_users
     - cache_existing_users
+    - purge_user
+    - purge_progress
 """
 import time
-from base64 import urlsafe_b64encode
-from cryptography.fernet import Fernet
+from functools import lru_cache
 
-from .redis import set_data, get_data, delete_key
+from .redis import delete_key, delete_many, add_members, remove_members, is_member, get_members, key_exists
+from .session import create_session, validate_session, end_user_session
 from .dynamo import create_or_update_record, list_records, get_record, delete_record
+from .elastic import delete_by_query, task_status
+from .indexes import read_alias, keyword_term
+from .stats import stats_key
 
 from constants import SECRET_KEY, INDEX_KEYS
-crypt = Fernet(SECRET_KEY)
+
+@lru_cache(maxsize = None)
+def crypt():
+    from cryptography.fernet import Fernet
+    return Fernet(SECRET_KEY)
+
+# Redis set holding every registered username
+USERNAME_SET = "ExistingUsernames"
 
 def validate_cache(cacheKey, username = None):
     """
@@ -39,13 +52,7 @@ def validate_cache(cacheKey, username = None):
         return False
 
     try:
-        cacheObj = get_data(cacheKey)
-        if cacheObj['expiry_timestamp'] < int(time.time()):
-            delete_key(cacheKey)
-            return False
-        if username and cacheObj['username'] != username:
-            return False
-        return True
+        return bool(validate_session(cacheKey, username))
 
     except Exception as e:
         print("Exception @ validate_cache\n{}".format(e))
@@ -66,23 +73,32 @@ def signup_user(body):
         return False
 
     try:
-        existingUsers = existing_users()
-        if body['username'] in existingUsers:
-            # Username already taken
-            return False
+        if not key_exists(USERNAME_SET) and not cache_existing_users():
+            # Username directory could not be seeded
+            return None
 
         # TODO: Validate username
 
+        # SADD is atomic, a concurrent signup for the same username gets 0
+        if not add_members(USERNAME_SET, [body['username']]):
+            # Username already taken
+            return False
+
         body = {
             **body,
             "index": INDEX_KEYS[body['username'][0].lower()], # Create index
-            "password": crypt.encrypt(body['password'].encode()).decode(), # Encrypt password
+            "password": crypt().encrypt(body['password'].encode()).decode(), # Encrypt password
             "created_timestamp": int(time.time()) # Creation timestamp
         }
-        if not create_or_update_record("users", body):
-            return False
-        cache_existing_users()
-        return True
+        from boto3.dynamodb.conditions import Attr
+        # Never overwrite an existing user record
+        created = create_or_update_record("users", body, Attr("username").not_exists())
+        if created is None:
+            # Write failed, release the reserved username
+            remove_members(USERNAME_SET, [body['username']])
+            return None
+        # False means the record already exists, the username stays reserved
+        return created
 
     except Exception as e:
         print("Exception @ signup_user\n{}".format(e))
@@ -110,15 +126,10 @@ def login_user(username, password):
 
         if not record:
             return False
-        if crypt.decrypt(record['password'].encode()).decode() == password:
-            # User has been verified, Create login cache
-            cacheObj = {
-                "username": username,
-                "login_timestamp": int(time.time()), # Cache timestamp
-                "expiry_timestamp": int(time.time()) + 7200 # Cache expiry in 2hrs
-            }
-            # Return cache key & expiry
-            return { "key": set_data(cacheObj), "expiry_timestamp": cacheObj['expiry_timestamp'] }
+        if crypt().decrypt(record['password'].encode()).decode() == password:
+            # User has been verified, Create login session
+            # Return session key & expiry
+            return create_session(username)
         else:
             return False
 
@@ -140,13 +151,34 @@ def logout_user(username):
         return False
 
     try:
-        cacheKey = "UserCache_" + urlsafe_b64encode(username.encode('ascii')).decode()
-        return delete_key(cacheKey)
+        return end_user_session(username)
 
     except Exception as e:
         print("Exception @ logout_user\n{}".format(e))
         return None
 
+def username_exists(username):
+    """
+    Function to check if a username is already taken
+
+    Params:
+        username::str
+    Returns:
+        bool
+            If the username exists or not
+    """
+    if not username:
+        return False
+
+    try:
+        if not key_exists(USERNAME_SET):
+            cache_existing_users()
+        return is_member(USERNAME_SET, username)
+
+    except Exception as e:
+        print("Exception @ username_exists\n{}".format(e))
+        return None
+
 def existing_users():
     """
     Function to get list of existing users
@@ -156,13 +188,9 @@ def existing_users():
             The list of existing users
     """
     try:
-        cacheList = get_data("ExistingUserListCache")
-        if cacheList:
-            return cacheList['users']
-        else:
-            records = list_records("users")
-            users = list(map(lambda r: r['username'] , records))
-            return users
+        if not key_exists(USERNAME_SET):
+            cache_existing_users()
+        return get_members(USERNAME_SET)
 
     except Exception as e:
         print("Exception @ existing_users\n{}".format(e))
@@ -170,18 +198,93 @@ def existing_users():
 
 def cache_existing_users():
     """
-    Function to create a cache of list of existing users
+    Function to seed the username set from the "users" table
+    Only needed when the set is missing, signups keep it up to date
 
     Returns:
         bool
-            If the cache key was created or not
+            If the username set was created or not
     """
     try:
-        records = list_records("users")
+        records = list_records("users", ["username"])
+        if records is None or records is False:
+            return False
         users = list(map(lambda r: r['username'] , records))
-        set_data({ "users": users, "timestamp": int(time.time()) }, "ExistingUserListCache")
+        # Add in chunks to keep each command small
+        for i in range(0, len(users), 1000):
+            if add_members(USERNAME_SET, users[i:i + 1000]) is None:
+                return False
+        # Drop the old JSON list cache
+        delete_key("ExistingUserListCache")
         return True
 
     except Exception as e:
         print("Exception @ cache_existing_users\n{}".format(e))
-        return None
\ No newline at end of file
+        return None
+
+def purge_user(username, requestsPerSecond = 500):
+    """
+    Function to remove a user and everything they created
+    The user record and Redis keys are removed right away, the journeys &
+    spottings of every year are deleted by a throttled background task
+
+    Params:
+        username::str
+        requestsPerSecond::int
+            Throttle of the deletion, in documents per second
+    Returns:
+        taskID::str
+            The task deleting the documents, see purge_progress
+    """
+    if not username:
+        return False
+
+    try:
+        taskID = delete_by_query(
+            ",".join([read_alias("journeys"), read_alias("spottings")]),
+            keyword_term("username", username),
+            requestsPerSecond
+        )
+        if isinstance(taskID, Exception):
+            raise taskID
+        if delete_record("users", { "username": username, "index": INDEX_KEYS[username[0].lower()] }) is None:
+            return None
+        end_user_session(username)
+        from .journey import active_journey_key
+        delete_many([stats_key(username), active_journey_key(username)])
+        remove_members(USERNAME_SET, [username])
+        return taskID
+
+    except Exception as e:
+        print("Exception @ purge_user\n{}".format(e))
+        return None
+
+def purge_progress(taskID):
+    """
+    Function to get the progress of a purge_user task
+
+    Params:
+        taskID::str
+            The task ID returned by purge_user
+    Returns:
+        completed::bool
+            If all the documents have been deleted
+        total::int
+            Documents to delete
+        done::int
+            Documents deleted so far
+        failures::[dict]
+            Failures, once the task has finished
+    """
+    if not taskID:
+        return False
+
+    try:
+        res = task_status(taskID)
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+    except Exception as e:
+        print("Exception @ purge_progress\n{}".format(e))
+        return None